@@ -0,0 +1,133 @@
+"""Concurrent read/write throughput of the SQLite layer.
+
+Runs reader threads doing comic lookups (as every page request does) with an
+occasional full library listing, and writer threads saving reading progress against a throwaway database, once with the legacy access pattern
+(new connection + rollback journal per call) and once through database.py.
+
+    python benchmarks/bench_db.py [--comics 5000] [--readers 4] [--writers 2] [--seconds 5]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+def _seed(db_path, comics):
+    database.DB_PATH = db_path
+    database.init_db()
+    rows = [(f"/library/series{i // 50}/book{i}.cbz", f"Book {i}", 'cbz', 1000 + i, i, None) for i in range(comics)]
+    database.apply_scan(rows, [])
+    database.close_connection()
+
+# The access pattern database.py had before pooling: one connection per call
+def _legacy_connection(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _legacy_list(db_path):
+    conn = _legacy_connection(db_path)
+    rows = conn.execute('SELECT * FROM comics ORDER BY title ASC').fetchall()
+    conn.close()
+    return len(rows)
+
+def _legacy_lookup(db_path, comic_id):
+    conn = _legacy_connection(db_path)
+    row = conn.execute('SELECT * FROM comics WHERE id = ?', (comic_id,)).fetchone()
+    conn.close()
+    return row
+
+def _legacy_progress(db_path, comic_id, page):
+    conn = _legacy_connection(db_path)
+    conn.execute('UPDATE comics SET current_page = ?, status = ?, last_read_at = ? WHERE id = ?',
+                 (page, 'reading', datetime.now(), comic_id))
+    conn.commit()
+    conn.close()
+
+def _pooled_list(db_path):
+    return len(database.get_all_comics())
+
+def _pooled_lookup(db_path, comic_id):
+    return database.get_comic(comic_id)
+
+def _pooled_progress(db_path, comic_id, page):
+    database.update_progress(comic_id, page)
+
+def _run(mode, db_path, comics, readers, writers, seconds):
+    if mode == 'legacy':
+        list_fn, lookup_fn, write_fn = _legacy_list, _legacy_lookup, _legacy_progress
+    else:
+        list_fn, lookup_fn, write_fn = _pooled_list, _pooled_lookup, _pooled_progress
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def reader():
+        n = 0
+        while time.perf_counter() < deadline:
+            if n % 100 == 0:
+                list_fn(db_path)
+            else:
+                lookup_fn(db_path, random.randint(1, comics))
+            n += 1
+        with lock:
+            counts['reads'] += n
+
+    def writer():
+        n = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                write_fn(db_path, random.randint(1, comics), random.randint(0, 200))
+                n += 1
+            except sqlite3.OperationalError:
+                # database is locked
+                errors += 1
+        with lock:
+            counts['writes'] += n
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        'mode': mode,
+        'reads_per_sec': round(counts['reads'] / seconds, 1),
+        'writes_per_sec': round(counts['writes'] / seconds, 1),
+        'errors': counts['errors'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--comics', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('legacy', 'pooled'):
+            db_path = os.path.join(tmp, f'{mode}.db')
+            _seed(db_path, args.comics)
+            if mode == 'legacy':
+                # The old database never left the default rollback journal
+                conn = sqlite3.connect(db_path)
+                conn.execute('PRAGMA journal_mode = DELETE')
+                conn.close()
+            results.append(_run(mode, db_path, args.comics, args.readers, args.writers, args.seconds))
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Page throughput with the decode pool at 1..N worker processes.
+
+Builds a few synthetic PDFs and deflated PNG/JPEG CBZs (see synthetic.py),
+then has --concurrency threads request pages as the page endpoint would:
+PDF renders, resized variants and deflated pages, with every cache off so
+each request does the full work. The first run is in-process (workers=0).
+
+    python benchmarks/bench_decode.py [--max-workers 8] [--concurrency 8] [--requests 120]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic
+import decodepool
+from reader import ComicReader
+
+def _build_library(root, page_size):
+    synthetic.generate(root, comics=4, pages=20, pdfs=2, pdf_pages=40, depth=1, page_size=page_size, seed=7)
+    files = []
+    for folder, _, names in os.walk(root):
+        files.extend(os.path.join(folder, name) for name in names)
+    return sorted(files)
+
+def _workload(readers, requests):
+    """(reader, page, kwargs) tuples cycling over the books; widths vary so
+    no two requests ask for the same variant"""
+    jobs = []
+    for i in range(requests):
+        reader = readers[i % len(readers)]
+        page = (i // len(readers)) % reader.get_page_count()
+        kind = i % 3
+        if reader.type == 'pdf':
+            kwargs = {'width': 800 + 64 * (i % 8)}
+        elif kind == 0:
+            kwargs = {}
+        else:
+            kwargs = {'width': 400 + i % 97, 'fmt': 'webp' if kind == 1 else 'jpeg'}
+        jobs.append((reader, page, kwargs))
+    return jobs
+
+def _run(files, workers, concurrency, requests):
+    pool = decodepool.configure(workers)
+    if pool is not None:
+        pool.start()
+    readers = [ComicReader(path) for path in files]
+    jobs = _workload(readers, requests)
+    failures = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                reader, page, kwargs = jobs.pop()
+            if reader.get_page_data(page, **kwargs) is None:
+                failures.append((reader.file_path, page))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    stats = pool.stats() if pool is not None else None
+    for reader in readers:
+        reader.close()
+    decodepool.configure(0)
+    return {
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'pages_per_sec': round(requests / elapsed, 1),
+        'failures': len(failures),
+        'pool': stats,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--concurrency', type=int, default=8, help='threads requesting pages')
+    parser.add_argument('--requests', type=int, default=120)
+    parser.add_argument('--page-size', type=int, nargs=2, default=(1200, 1800), metavar=('W', 'H'))
+    args = parser.parse_args()
+
+    counts = [0]
+    n = 1
+    while n < args.max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(args.max_workers)
+
+    root = tempfile.mkdtemp(prefix='kubrick-decode-')
+    try:
+        files = _build_library(root, tuple(args.page_size))
+        results = [_run(files, workers, args.concurrency, args.requests) for workers in counts]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    baseline = results[0]['pages_per_sec']
+    for result in results:
+        result['speedup'] = round(result['pages_per_sec'] / baseline, 2) if baseline else None
+    print(json.dumps({'cpu_count': os.cpu_count(), 'concurrency': args.concurrency,
+                      'requests': args.requests, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Commit rate of reading progress, synchronous vs write-behind.
+
+Simulates readers turning pages (continuous scroll reports a page every few
+milliseconds) against a throwaway database, once committing every turn as
+the progress endpoint used to and once through writebehind.ProgressBuffer.
+
+    python benchmarks/bench_progress.py [--readers 4] [--turn-ms 5] [--seconds 5] [--interval 2]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import writebehind
+
+def _seed(db_path, comics):
+    database.DB_PATH = db_path
+    database.init_db()
+    rows = [(f"/library/book{i}.cbz", f"Book {i}", 'cbz', 1000 + i, i, None) for i in range(comics)]
+    database.apply_scan(rows, [])
+
+def _run(mode, readers, turn_ms, seconds, interval):
+    buffer = writebehind.ProgressBuffer(interval=interval) if mode == 'write-behind' else None
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def reader(comic_id):
+        mine = []
+        page = 0
+        while time.perf_counter() < deadline:
+            page += 1
+            start = time.perf_counter()
+            if buffer is None:
+                database.update_progress(comic_id, page)
+            else:
+                buffer.record(comic_id, page)
+            mine.append(time.perf_counter() - start)
+            time.sleep(turn_ms / 1000)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=reader, args=(random.randint(1, 100),)) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if buffer is None:
+        commits = len(latencies)
+    else:
+        buffer.stop()
+        commits = buffer.commits
+    latencies.sort()
+    return {
+        'mode': mode,
+        'page_turns': len(latencies),
+        'commits': commits,
+        'commits_per_sec': round(commits / seconds, 1),
+        'turn_p50_us': round(statistics.median(latencies) * 1e6, 1),
+        'turn_p99_us': round(latencies[int(len(latencies) * 0.99) - 1] * 1e6, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--turn-ms', type=float, default=5, help='pause between page turns per reader')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--interval', type=float, default=writebehind.FLUSH_INTERVAL, help='write-behind flush interval')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('synchronous', 'write-behind'):
+            _seed(os.path.join(tmp, f'{mode}.db'), 100)
+            results.append(_run(mode, args.readers, args.turn_ms, args.seconds, args.interval))
+            database.close_connection()
+    saved = results[0]['commits_per_sec'] - results[1]['commits_per_sec']
+    print(json.dumps({'results': results, 'commits_per_sec_saved': round(saved, 1)}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Cold start of the backend: time until /api/health answers and until it is ready.
+
+Launches main.py with waitress several times against a throwaway database
+and cache (the first launch creates the schema, later ones find it current),
+and once more under -X importtime to list the slowest imports. Prints JSON;
+with --budget-ms the exit status is 1 when the median time to health exceeds
+it, so a regression fails CI.
+
+    python benchmarks/bench_startup.py [--runs 5] [--port 5099] [--budget-ms 1500]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(BACKEND_DIR, 'main.py')
+
+def _health(port):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/api/health', timeout=1) as response:
+            return json.load(response)
+    except OSError:
+        return None
+
+def _launch(port, state_dir, timeout, importtime=False):
+    env = dict(os.environ, KUBRICK_DB_PATH=os.path.join(state_dir, 'library.db'),
+               KUBRICK_CACHE_DIR=os.path.join(state_dir, 'cache'), KUBRICK_WATCH='0',
+               KUBRICK_LOG_LEVEL='WARNING')
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + \
+          [MAIN, '--server', 'waitress', '--port', str(port)]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    first = ready = None
+    try:
+        while time.perf_counter() - start < timeout:
+            health = _health(port)
+            if health is not None:
+                if first is None:
+                    first = time.perf_counter() - start
+                if health.get('ready'):
+                    ready = time.perf_counter() - start
+                    break
+            elif proc.poll() is not None:
+                break
+            time.sleep(0.005)
+    finally:
+        proc.terminate()
+        _, stderr = proc.communicate(timeout=30)
+    if first is None:
+        raise RuntimeError(f'backend did not answer within {timeout}s:\n{stderr[-2000:]}')
+    return {'health_ms': round(first * 1000, 1), 'ready_ms': round(ready * 1000, 1) if ready else None,
+            'server': health.get('startup')}, stderr
+
+def _slowest_imports(stderr, top):
+    """Top-level packages by cumulative import time from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two more spaces per level
+        if not name.startswith('  '):
+            rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return [{'module': name, 'ms': round(us / 1000, 1)} for us, name in rows[:top]]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--top', type=int, default=15, help='slowest imports listed')
+    parser.add_argument('--budget-ms', type=float, help='fail when the median time to health is above this')
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as state_dir:
+        for _ in range(args.runs):
+            runs.append(_launch(args.port, state_dir, args.timeout)[0])
+        _, stderr = _launch(args.port, state_dir, args.timeout, importtime=True)
+
+    warm = runs[1:] or runs
+    health_p50 = statistics.median(r['health_ms'] for r in warm)
+    report = {
+        'first_run': runs[0],
+        'health_p50_ms': health_p50,
+        'ready_p50_ms': statistics.median(r['ready_ms'] for r in warm if r['ready_ms'] is not None),
+        'runs': runs,
+        'slowest_imports': _slowest_imports(stderr, args.top),
+    }
+    if args.budget_ms is not None:
+        report['budget_ms'] = args.budget_ms
+        report['within_budget'] = health_p50 <= args.budget_ms
+    print(json.dumps(report, indent=2))
+    if args.budget_ms is not None and health_p50 > args.budget_ms:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""End-to-end benchmark suite over a synthetic library.
+
+Generates (or reuses) a seeded library with synthetic.py, then drives the app
+through the Flask test client against a throwaway database and cache:
+cold and incremental scan, /api/library, the cover grid, first-page latency,
+sequential page turns, background indexing and peak RSS. Results are printed
+as JSON (with the git commit) so runs can be diffed between commits:
+
+    python benchmarks/bench_suite.py [--workdir DIR] [--comics 1000] [--output before.json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import synthetic
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+def _summary(samples):
+    """p50/p95/max in milliseconds of a list of durations in seconds"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'p50_ms': _ms(statistics.median(ordered)),
+        'p95_ms': _ms(ordered[max(0, int(len(ordered) * 0.95) - 1)]),
+        'max_ms': _ms(ordered[-1]),
+    }
+
+def _timed_get(client, url, expect=200):
+    start = time.perf_counter()
+    response = client.get(url)
+    # Streamed bodies (stored CBZ pages) are only read here
+    body = response.get_data()
+    elapsed = time.perf_counter() - start
+    if response.status_code != expect:
+        raise RuntimeError(f'GET {url} returned {response.status_code}')
+    response.close()
+    return elapsed, len(body)
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _prepare_library(workdir, params):
+    """Reuses workdir/library when it was generated with the same parameters"""
+    library = os.path.join(workdir, 'library')
+    params_path = os.path.join(workdir, 'params.json')
+    try:
+        with open(params_path, encoding='utf-8') as f:
+            if json.load(f) == params and os.path.isdir(library):
+                return library, None
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(library, ignore_errors=True)
+    start = time.perf_counter()
+    synthetic.generate(library, **params)
+    generated = time.perf_counter() - start
+    with open(params_path, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+    return library, generated
+
+def run(library, state_dir, args):
+    # The app reads its paths at import time
+    os.environ['KUBRICK_DB_PATH'] = os.path.join(state_dir, 'library.db')
+    os.environ['KUBRICK_CACHE_DIR'] = os.path.join(state_dir, 'cache')
+    os.environ['KUBRICK_WATCH'] = '0'
+    os.environ.setdefault('KUBRICK_LOG_LEVEL', 'WARNING')
+
+    import database
+    import indexer
+    import logs
+    import main
+    import scanner
+
+    logs.configure(os.environ['KUBRICK_LOG_LEVEL'])
+    database.init_db()
+    client = main.app.test_client()
+    rng = random.Random(args.seed)
+    results = {}
+
+    start = time.perf_counter()
+    scan = scanner.scan_directory(library)
+    elapsed = time.perf_counter() - start
+    results['scan_cold'] = {'ms': _ms(elapsed), 'files': scan['added'],
+                            'files_per_sec': round(scan['added'] / elapsed, 1) if elapsed else None}
+    start = time.perf_counter()
+    scan = scanner.scan_directory(library)
+    results['scan_incremental'] = {'ms': _ms(time.perf_counter() - start), 'skipped': scan['skipped']}
+
+    comics = client.get('/api/library').get_json()
+    comic_ids = [comic['id'] for comic in comics]
+    pdf_ids = [comic['id'] for comic in comics if comic['format'] == 'pdf']
+    cbz_ids = [comic_id for comic_id in comic_ids if comic_id not in pdf_ids]
+
+    library_times = {}
+    for sort in ('title', 'added', 'recent'):
+        full = [_timed_get(client, f'/api/library?sort={sort}')[0] for _ in range(args.repeat)]
+        paged = [_timed_get(client, f'/api/library?sort={sort}&limit=100')[0] for _ in range(args.repeat)]
+        library_times[sort] = {'full_p50_ms': _summary(full)['p50_ms'], 'limit100_p50_ms': _summary(paged)['p50_ms']}
+    results['library'] = library_times
+
+    # The first screen of the grid, before the background indexer has made any cover
+    grid = comic_ids[:args.grid]
+    cold = [_timed_get(client, f'/api/comic/{comic_id}/cover')[0] for comic_id in grid]
+    start = time.perf_counter()
+    warm = [_timed_get(client, f'/api/comic/{comic_id}/cover')[0] for comic_id in grid]
+    results['cover_grid'] = {
+        'covers': len(grid),
+        'cold_total_ms': _ms(sum(cold)),
+        'cold': _summary(cold),
+        'warm_total_ms': _ms(time.perf_counter() - start),
+        'warm': _summary(warm),
+    }
+
+    # Opening a book nobody has read yet: metadata, manifest and the first page
+    unopened = [comic_id for comic_id in cbz_ids if comic_id not in grid]
+    samples = rng.sample(unopened, min(args.first_pages, len(unopened))) + pdf_ids[:2]
+    first_page = []
+    for comic_id in samples:
+        start = time.perf_counter()
+        _timed_get(client, f'/api/comic/{comic_id}')
+        _timed_get(client, f'/api/comic/{comic_id}/manifest')
+        _timed_get(client, f'/api/comic/{comic_id}/page/0')
+        first_page.append(time.perf_counter() - start)
+    results['first_page'] = _summary(first_page)
+
+    # Reading straight through, with a pause per page like a person (read-ahead works meanwhile)
+    turns = {}
+    for label, ids in (('cbz', cbz_ids), ('pdf', pdf_ids)):
+        if not ids:
+            continue
+        comic_id = rng.choice(ids)
+        page_count = client.get(f'/api/comic/{comic_id}').get_json()['page_count']
+        times = []
+        for page in range(1, min(page_count, args.turns + 1)):
+            time.sleep(args.turn_delay_ms / 1000)
+            times.append(_timed_get(client, f'/api/comic/{comic_id}/page/{page}')[0])
+        turns[label] = _summary(times)
+    results['page_turns'] = turns
+
+    # What the background indexer does after a scan, run inline
+    remaining = database.get_unindexed_comic_ids()
+    start = time.perf_counter()
+    for comic_id in remaining:
+        indexer.index_comic(comic_id)
+    elapsed = time.perf_counter() - start
+    results['index'] = {'comics': len(remaining), 'ms': _ms(elapsed),
+                        'per_comic_ms': _ms(elapsed / len(remaining)) if remaining else None}
+
+    main.PROGRESS.stop()
+    database.close_connection()
+    results['peak_rss_mb'] = _peak_rss_mb()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workdir', help='keeps the generated library between runs (default: a temp dir)')
+    parser.add_argument('--comics', type=int, default=1000)
+    parser.add_argument('--pages', type=int, default=20, help='average pages per CBZ')
+    parser.add_argument('--pdfs', type=int, default=4)
+    parser.add_argument('--pdf-pages', type=int, default=300)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--grid', type=int, default=60, help='covers on the first grid screen')
+    parser.add_argument('--first-pages', type=int, default=20, help='unopened books to time page 0 of')
+    parser.add_argument('--turns', type=int, default=40, help='sequential page turns per format')
+    parser.add_argument('--turn-delay-ms', type=float, default=50)
+    parser.add_argument('--repeat', type=int, default=5, help='samples per /api/library query')
+    parser.add_argument('--output', help='write the JSON here as well as to stdout')
+    args = parser.parse_args()
+
+    params = {'comics': args.comics, 'pages': args.pages, 'pdfs': args.pdfs,
+              'pdf_pages': args.pdf_pages, 'depth': args.depth, 'seed': args.seed}
+    workdir = args.workdir or tempfile.mkdtemp(prefix='kubrick-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    library, generated = _prepare_library(workdir, params)
+    # Database and caches always start cold
+    state_dir = tempfile.mkdtemp(prefix='state-', dir=workdir)
+    try:
+        results = run(library, state_dir, args)
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'library': dict(params, generate_ms=_ms(generated) if generated is not None else None),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Concurrent page throughput against a running backend.
+
+Fetches the library, then has N client threads request pages spread over
+every comic (as the Reader grid view does when it loads), each thread on its
+own keep-alive connection. Run it against the backend started with each
+--server mode to compare them:
+
+    python main.py --server waitress --threads 16
+    python benchmarks/load_test.py [--url http://127.0.0.1:5000] [--concurrency 1 4 16 32] [--requests 400] [--width 320]
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+def _get(conn, path):
+    conn.request('GET', path)
+    response = conn.getresponse()
+    body = response.read()
+    return response.status, body
+
+def _page_paths(host, port, width, limit):
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    status, body = _get(conn, '/api/library')
+    if status != 200:
+        raise SystemExit(f'/api/library returned {status}')
+    paths = []
+    for comic in json.loads(body):
+        status, body = _get(conn, f"/api/comic/{comic['id']}")
+        if status != 200:
+            continue
+        for index in range(json.loads(body).get('page_count') or 0):
+            query = f'?w={width}' if width else ''
+            paths.append(f"/api/comic/{comic['id']}/page/{index}{query}")
+            if len(paths) >= limit:
+                break
+        if len(paths) >= limit:
+            break
+    conn.close()
+    if not paths:
+        raise SystemExit('The library has no readable pages; scan a folder first')
+    return paths
+
+def _run(host, port, paths, concurrency, requests):
+    latencies = []
+    counts = {'errors': 0, 'bytes': 0}
+    lock = threading.Lock()
+    cursor = iter(range(requests))
+
+    def client():
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        mine = []
+        errors = size = 0
+        while True:
+            with lock:
+                n = next(cursor, None)
+            if n is None:
+                break
+            start = time.perf_counter()
+            try:
+                status, body = _get(conn, paths[n % len(paths)])
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=60)
+                errors += 1
+                continue
+            mine.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+            size += len(body)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            counts['errors'] += errors
+            counts['bytes'] += size
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': counts['errors'],
+        'pages_per_sec': round(len(latencies) / elapsed, 1),
+        'mb_per_sec': round(counts['bytes'] / elapsed / 1e6, 2),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument('--requests', type=int, default=400, help='requests per concurrency level')
+    parser.add_argument('--width', type=int, default=0, help='request resized pages (?w=) instead of originals')
+    parser.add_argument('--pages', type=int, default=2000, help='distinct pages to cycle through')
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    paths = _page_paths(host, port, args.width, args.pages)
+    results = [_run(host, port, paths, c, args.requests) for c in args.concurrency]
+    print(json.dumps({'url': args.url, 'distinct_pages': len(paths), 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
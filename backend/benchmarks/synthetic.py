@@ -0,0 +1,133 @@
+"""Synthetic comic library generator.
+
+Builds a deterministic (seeded) tree of CBZ files, stored or deflated with
+JPEG, PNG or WebP pages, plus long PDFs, spread over nested
+publisher/series folders. Used by bench_suite.py; also runnable on its own:
+
+    python benchmarks/synthetic.py OUT_DIR [--comics 1000] [--pages 20] [--pdfs 4] [--pdf-pages 300]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import struct
+import zipfile
+
+from PIL import Image, ImageDraw
+
+# Share of CBZs per (page format, compression)
+CBZ_KINDS = [
+    (('jpeg', zipfile.ZIP_STORED), 45),
+    (('jpeg', zipfile.ZIP_DEFLATED), 25),
+    (('png', zipfile.ZIP_STORED), 10),
+    (('png', zipfile.ZIP_DEFLATED), 5),
+    (('webp', zipfile.ZIP_STORED), 15),
+]
+EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp'}
+# Distinct page images per format; pages are made unique by a trailing tag
+POOL_SIZE = 12
+
+def _draw_page(rng, size):
+    """A page with a gradient and panels, so codecs do realistic work"""
+    width, height = size
+    top = tuple(rng.randrange(256) for _ in range(3))
+    bottom = tuple(rng.randrange(256) for _ in range(3))
+    gradient = Image.linear_gradient('L').resize(size)
+    image = Image.composite(Image.new('RGB', size, bottom), Image.new('RGB', size, top), gradient)
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(4, 9)):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 8, width // 2), y0 + rng.randrange(height // 8, height // 3)
+        draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)),
+                       outline=(0, 0, 0), width=3)
+        for _ in range(rng.randint(2, 6)):
+            tx, ty = rng.randrange(x0, x1 + 1), rng.randrange(y0, y1 + 1)
+            draw.text((tx, ty), 'KUBRICK ' * rng.randint(1, 3), fill=(0, 0, 0))
+    return image
+
+def _encode(image, fmt):
+    buf = io.BytesIO()
+    if fmt == 'jpeg':
+        image.save(buf, 'JPEG', quality=85)
+    elif fmt == 'png':
+        image.save(buf, 'PNG', compress_level=6)
+    else:
+        image.save(buf, 'WEBP', quality=80)
+    return buf.getvalue()
+
+def _page_pool(rng, size):
+    images = [_draw_page(rng, size) for _ in range(POOL_SIZE)]
+    return images, {fmt: [_encode(image, fmt) for image in images] for fmt in EXTENSIONS}
+
+def _pick_kind(rng):
+    kinds, weights = zip(*CBZ_KINDS)
+    return rng.choices(kinds, weights=weights)[0]
+
+def _folder(rng, root, depth, index):
+    parts = [f'Publisher {rng.randrange(8):02d}']
+    if depth > 1:
+        parts.append(f'Series {index // 25:04d}')
+    for level in range(2, depth):
+        parts.append(f'Volume {rng.randrange(4)}')
+    return os.path.join(root, *parts)
+
+def write_cbz(path, pool, fmt, compression, pages, rng, serial):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(path, 'w', compression=compression) as zf:
+        for page in range(pages):
+            data = pool[fmt][rng.randrange(POOL_SIZE)]
+            # Bytes after the image's end marker are ignored by decoders but make
+            # every page's CRC distinct, like real scans
+            data += struct.pack('<QI', serial, page)
+            zf.writestr(f'page{page + 1:03d}{EXTENSIONS[fmt]}', data)
+        zf.writestr('ComicInfo.xml', f'<ComicInfo><Title>Book {serial}</Title></ComicInfo>')
+
+def write_pdf(path, images, pages, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frames = [images[rng.randrange(len(images))] for _ in range(pages)]
+    frames[0].save(path, 'PDF', save_all=True, append_images=frames[1:], resolution=72, quality=80)
+
+def generate(root, comics=1000, pages=20, pdfs=4, pdf_pages=300, depth=3, page_size=(480, 720), seed=1):
+    """Writes the library under root and returns a summary dict.
+    Existing files with the same names are overwritten."""
+    rng = random.Random(seed)
+    images, pool = _page_pool(rng, page_size)
+    kinds = {}
+    total_bytes = 0
+    for i in range(comics):
+        fmt, compression = _pick_kind(rng)
+        path = os.path.join(_folder(rng, root, depth, i), f'Book {i:05d}.cbz')
+        write_cbz(path, pool, fmt, compression, rng.randint(max(1, pages // 2), pages * 3 // 2), rng, i)
+        kind = f"{fmt}_{'stored' if compression == zipfile.ZIP_STORED else 'deflated'}"
+        kinds[kind] = kinds.get(kind, 0) + 1
+        total_bytes += os.path.getsize(path)
+    for i in range(pdfs):
+        path = os.path.join(root, 'PDF', f'Document {i:03d}.pdf')
+        write_pdf(path, images, pdf_pages, rng)
+        total_bytes += os.path.getsize(path)
+    return {
+        'root': root,
+        'comics': comics,
+        'pdfs': pdfs,
+        'cbz_kinds': kinds,
+        'bytes': total_bytes,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('out_dir')
+    parser.add_argument('--comics', type=int, default=1000)
+    parser.add_argument('--pages', type=int, default=20, help='average pages per CBZ')
+    parser.add_argument('--pdfs', type=int, default=4)
+    parser.add_argument('--pdf-pages', type=int, default=300)
+    parser.add_argument('--depth', type=int, default=3, help='folder nesting below the root')
+    parser.add_argument('--page-size', type=int, nargs=2, default=(480, 720), metavar=('W', 'H'))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    summary = generate(args.out_dir, args.comics, args.pages, args.pdfs, args.pdf_pages,
+                       args.depth, tuple(args.page_size), args.seed)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Root of every on-disk cache, next to the database
+CACHE_DIR = os.environ.get('KUBRICK_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# Bounds for the open-reader LRU
+READER_CACHE_SIZE = int(os.environ.get('KUBRICK_READER_CACHE_SIZE', 16))
+READER_CACHE_BYTES = int(os.environ.get('KUBRICK_READER_CACHE_MB', 256)) * 1024 * 1024
+
+class ReaderCache:
+    """Thread-safe LRU of open ComicReader instances, bounded by count and estimated memory.
+
+    Evicted readers are closed so their archive handles and PDF documents are released.
+    """
+
+    def __init__(self, max_readers=READER_CACHE_SIZE, max_bytes=READER_CACHE_BYTES):
+        self.max_readers = max_readers
+        self.max_bytes = max_bytes
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, factory):
+        """Returns the cached reader for key, creating it with factory() on a miss"""
+        with self._lock:
+            reader = self._readers.get(key)
+            if reader is not None:
+                self._readers.move_to_end(key)
+                self.hits += 1
+                return reader
+            self.misses += 1
+
+        # Opening can be slow (archive listing, unrar), keep it outside the lock
+        reader = factory()
+        if reader is None:
+            return None
+
+        with self._lock:
+            existing = self._readers.get(key)
+            if existing is not None:
+                # Another request opened the same comic meanwhile
+                evicted = [reader]
+                reader = existing
+            else:
+                self._readers[key] = reader
+                evicted = self._evict()
+
+        for r in evicted:
+            r.close()
+        return reader
+
+    def _evict(self):
+        evicted = []
+        total = sum(r.estimated_memory() for r in self._readers.values())
+        # Always keep the most recent reader, even if it alone exceeds the budget
+        while len(self._readers) > 1 and (len(self._readers) > self.max_readers or total > self.max_bytes):
+            _, reader = self._readers.popitem(last=False)
+            total -= reader.estimated_memory()
+            self.evictions += 1
+            evicted.append(reader)
+        return evicted
+
+    def pop(self, key):
+        with self._lock:
+            reader = self._readers.pop(key, None)
+        if reader is not None:
+            reader.close()
+
+    def clear(self):
+        with self._lock:
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for reader in readers:
+            reader.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._readers),
+                'max_size': self.max_readers,
+                'bytes': sum(r.estimated_memory() for r in self._readers.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+# Byte budget for decoded/rendered pages kept in memory
+PAGE_CACHE_BYTES = int(os.environ.get('KUBRICK_PAGE_CACHE_MB', 128)) * 1024 * 1024
+
+class PageCache:
+    """Thread-safe LRU of page bytes, bounded by their total size.
+
+    Entries added by read-ahead are flagged so the cache can report how many
+    prefetched pages were actually requested and how many were evicted unused.
+    """
+
+    def __init__(self, max_bytes=PAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        # Key -> [data, prefetched and not requested yet]
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if entry[1]:
+                entry[1] = False
+                self.prefetch_hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        """Like get(), but without touching LRU order or statistics"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def put(self, key, data, prefetched=False):
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = [data, prefetched]
+            self._bytes += size
+            if prefetched:
+                self.prefetched += 1
+            while self._bytes > self.max_bytes:
+                _, (old_data, unused) = self._entries.popitem(last=False)
+                self._bytes -= len(old_data)
+                self.evictions += 1
+                if unused:
+                    self.prefetch_wasted += 1
+
+    def invalidate(self, file_path):
+        """Drops every page of a file (or of every file under a folder), e.g. after it changed on disk"""
+        prefix = file_path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == file_path or k[0].startswith(prefix)]:
+                data, _ = self._entries.pop(key)
+                self._bytes -= len(data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'prefetched': self.prefetched,
+                'prefetch_hits': self.prefetch_hits,
+                'prefetch_wasted': self.prefetch_wasted,
+            }
+
+class DiskCache:
+    """Size-bounded directory of cached blobs, addressed by a hash of their key.
+
+    The least recently used files are deleted once the total exceeds max_bytes.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Path -> size, in access order; loaded from disk on first use
+        self._files = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self):
+        if self._files is not None:
+            return
+        found = []
+        if os.path.isdir(self.root):
+            for dirpath, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if name.endswith('.tmp'):
+                        # Leftover from an interrupted write
+                        _remove_quietly(path)
+                        continue
+                    found.append((st.st_mtime, path, st.st_size))
+        found.sort()
+        self._files = OrderedDict((path, size) for _, path, size in found)
+        self._bytes = sum(self._files.values())
+
+    def path_for(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, key):
+        """Returns the cached bytes for key, or None"""
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self._load()
+            if path in self._files:
+                self._files.move_to_end(path)
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temp name so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._load()
+            self._bytes -= self._files.pop(path, 0)
+            self._files[path] = len(data)
+            self._bytes += len(data)
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._files) > 1:
+                old_path, size = self._files.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+                evicted.append(old_path)
+        for old_path in evicted:
+            _remove_quietly(old_path)
+        return path
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {
+                'files': len(self._files),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class BookCache:
+    """Size-bounded directory of fully extracted books, one subdirectory per book.
+
+    Used for solid archives, where reading any one page means decompressing
+    everything before it. Whole books are evicted, least recently used first,
+    once the total exceeds max_bytes.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Book directory -> size, in access order; loaded from disk on first use
+        self._books = None
+        self._bytes = 0
+        # Book directory -> Event, for extractions in progress
+        self._filling = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self):
+        if self._books is not None:
+            return
+        found = []
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                if not entry.is_dir():
+                    continue
+                if entry.name.endswith('.tmp'):
+                    # Leftover from an interrupted extraction
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                found.append((entry.stat().st_mtime, entry.path, _tree_size(entry.path)))
+        found.sort()
+        self._books = OrderedDict((path, size) for _, path, size in found)
+        self._bytes = sum(self._books.values())
+
+    def path_for(self, key):
+        return os.path.join(self.root, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+    def __contains__(self, key):
+        with self._lock:
+            self._load()
+            return self.path_for(key) in self._books
+
+    def get(self, key, fill):
+        """Returns the directory holding the book for key, calling fill(directory)
+        to extract it on a miss. Concurrent callers for the same book wait for a
+        single extraction; None if that extraction failed."""
+        path = self.path_for(key)
+        with self._lock:
+            self._load()
+            if path in self._books:
+                self._books.move_to_end(path)
+                self.hits += 1
+                return path
+            event = self._filling.get(path)
+            owner = event is None
+            if owner:
+                event = self._filling[path] = threading.Event()
+                self.misses += 1
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                return path if path in self._books else None
+
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=self.root, suffix='.tmp')
+        try:
+            fill(tmp_path)
+            size = _tree_size(tmp_path)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            with self._lock:
+                self._filling.pop(path, None)
+            event.set()
+            raise
+
+        with self._lock:
+            self._books[path] = size
+            self._bytes += size
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._books) > 1:
+                old_path, old_size = self._books.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+                evicted.append(old_path)
+            self._filling.pop(path, None)
+        event.set()
+        for old_path in evicted:
+            shutil.rmtree(old_path, ignore_errors=True)
+        return path
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {
+                'books': len(self._books),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+def _tree_size(root):
+    total = 0
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
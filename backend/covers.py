@@ -0,0 +1,89 @@
+import logging
+import os
+import tempfile
+
+import database
+import integrity
+from cache import CACHE_DIR
+from reader import ComicReader
+
+log = logging.getLogger(__name__)
+
+# One JPEG thumbnail per comic
+COVERS_DIR = os.path.join(CACHE_DIR, 'covers')
+COVER_SIZE = (300, 450)
+COVER_QUALITY = 80
+
+def cover_key(comic_id, file_path):
+    """Key for a comic's cover, changes whenever the source file's size or mtime does"""
+    st = os.stat(file_path)
+    return f"{comic_id}_{st.st_size}_{st.st_mtime_ns}"
+
+def cover_path(key):
+    return os.path.join(COVERS_DIR, f"{key}.jpg")
+
+def get_cover(comic_id, reader=None):
+    """Returns (path, etag) of an up-to-date cover thumbnail, building it if needed"""
+    comic = database.get_comic(comic_id)
+    if not comic:
+        return None
+
+    try:
+        key = cover_key(comic['id'], comic['file_path'])
+    except OSError as e:
+        log.warning("Cover error, cannot stat %s: %s", comic['file_path'], e)
+        return None
+
+    path = cover_path(key)
+    if comic['cover_cached_path'] == path and os.path.exists(path):
+        return path, key
+
+    if not build_cover(comic, key, reader):
+        return None
+    return path, key
+
+def build_cover(comic, key=None, reader=None):
+    """Renders the thumbnail for a comic row and records it in comics.cover_cached_path.
+    Raises UnreadableComic when it has to open the comic itself and cannot."""
+    if key is None:
+        key = cover_key(comic['id'], comic['file_path'])
+
+    own_reader = reader is None
+    if own_reader:
+        reader = ComicReader(comic['file_path'])
+        error = integrity.BROKEN.record_reader(comic, reader)
+        if error:
+            reader.close()
+            raise integrity.UnreadableComic(comic['id'], *error)
+    try:
+        data = reader.get_page_thumbnail(0, COVER_SIZE, COVER_QUALITY)
+    finally:
+        if own_reader:
+            reader.close()
+    if data is None:
+        return False
+
+    path = cover_path(key)
+    os.makedirs(COVERS_DIR, exist_ok=True)
+    # Write under a temp name so a concurrent request never serves a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=COVERS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+    old_path = comic['cover_cached_path']
+    if old_path and old_path != path:
+        _remove_file(old_path)
+    database.set_cover_cached_path(comic['id'], path)
+    return True
+
+def remove_cover(comic_id):
+    comic = database.get_comic(comic_id)
+    if comic and comic['cover_cached_path']:
+        _remove_file(comic['cover_cached_path'])
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,12 +1,126 @@
+import logging
 import sqlite3
 import os
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+import metrics
+
+log = logging.getLogger(__name__)
+
 # Database logic
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'library.db')
+DB_PATH = os.environ.get('KUBRICK_DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'library.db')
+
+# Applied to every pooled connection. WAL lets readers (e.g. /api/library) run
+# while a scan is writing; synchronous=NORMAL is durable across app crashes
+# and only fsyncs at checkpoints.
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Statements compiled per connection and reused across calls
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
+class _TimedConnection(sqlite3.Connection):
+    """Connection that records statement and commit times in metrics.SQLITE_SECONDS"""
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            metrics.SQLITE_SECONDS.observe(time.perf_counter() - start, statement=_statement_kind(sql))
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            metrics.SQLITE_SECONDS.observe(time.perf_counter() - start, statement=_statement_kind(sql))
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.SQLITE_SECONDS.observe(time.perf_counter() - start, statement='COMMIT')
+
+def _statement_kind(sql):
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ''
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=STATEMENT_CACHE_SIZE,
+                           factory=_TimedConnection)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection():
+    """Returns this thread's pooled connection. Do not close it."""
+    conn = getattr(_local, 'conn', None)
+    # A forked worker process must not reuse its parent's connection
+    if conn is not None and _local.pid == os.getpid():
+        try:
+            conn.total_changes
+            return conn
+        except sqlite3.ProgrammingError:
+            # Someone closed it
+            pass
+    conn = _connect()
+    _local.conn = conn
+    _local.pid = os.getpid()
+    _local.depth = 0
+    return conn
+
+def close_connection():
+    """Closes this thread's pooled connection, if any"""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        conn.close()
+
+@contextmanager
+def transaction():
+    """Runs the block in one transaction on this thread's connection, committing
+    on success and rolling back on error. Nested blocks join the outer one."""
+    conn = get_connection()
+    if _local.depth:
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+
+    _local.depth = 1
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        _local.depth = 0
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
+    # An up-to-date database needs no DDL at all; this is every start but the first
+    if conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+        return
+    # Persistent per database file
+    conn.execute('PRAGMA journal_mode = WAL')
     c = conn.cursor()
     
     # Comics table
@@ -22,7 +136,22 @@ def init_db():
             status TEXT DEFAULT 'unread',
             cover_cached_path TEXT,
             added_at DATETIME,
-            last_read_at DATETIME
+            last_read_at DATETIME,
+            mtime_ns INTEGER,
+            manifest_mtime_ns INTEGER,
+            optimized_path TEXT,
+            optimized_mtime_ns INTEGER,
+            content_hash TEXT,
+            integrity_status TEXT,
+            integrity_error TEXT,
+            integrity_mtime_ns INTEGER
+        )
+    ''')
+    # Folders the user scanned; watched for changes while the app runs
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS library_roots (
+            path TEXT PRIMARY KEY,
+            added_at DATETIME
         )
     ''')
     
@@ -74,170 +203,553 @@ def init_db():
     ''')
     
     conn.commit()
-    conn.close()
+    _migrate(conn)
+
+def _ensure_column(c, table, column, decl):
+    columns = [r[1] for r in c.execute(f'PRAGMA table_info({table})').fetchall()]
+    if column not in columns:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+# --- Migrations ---
+# Schema changes on top of the CREATE TABLEs in init_db, applied in order.
+# PRAGMA user_version records how many have run. Append only, never reorder.
+def _migration_1(c):
+    # Scanner fingerprint (size_bytes + mtime_ns), missing on databases created before it
+    _ensure_column(c, 'comics', 'mtime_ns', 'INTEGER')
+
+def _migration_2(c):
+    # Indexes behind the paginated library listing (sort keys and filters)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comics_title ON comics (title COLLATE NOCASE, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comics_status ON comics (status)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comics_last_read_at ON comics (last_read_at, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comics_added_at ON comics (added_at, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comics_recent ON comics (COALESCE(last_read_at, added_at), id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_collection_items_comic ON collection_items (comic_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_page_markers_comic ON page_markers (comic_id)')
+
+def _migration_3(c):
+    # Full-text search over titles, page notes and marker text. External-content
+    # FTS5 tables keyed by the source rowid, kept in sync by triggers.
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS comics_fts USING fts5(
+            title, content='comics', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS page_notes_fts USING fts5(
+            note, content='page_actions',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS page_markers_fts USING fts5(
+            content, content='page_markers', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    for table, fts, column in (('comics', 'comics_fts', 'title'),
+                               ('page_actions', 'page_notes_fts', 'note'),
+                               ('page_markers', 'page_markers_fts', 'content')):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {column}) VALUES (new.rowid, new.{column});
+            END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.rowid, old.{column});
+            END
+        ''')
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.rowid, old.{column});
+                INSERT INTO {fts} (rowid, {column}) VALUES (new.rowid, new.{column});
+            END
+        ''')
+    rebuild_search_index(c)
+
+def _migration_4(c):
+    # Page manifest: each comic's pages in reading order, so readers open without
+    # listing the archive. Valid while comics.manifest_mtime_ns matches the file.
+    _ensure_column(c, 'comics', 'manifest_mtime_ns', 'INTEGER')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS pages (
+            comic_id INTEGER NOT NULL,
+            page_index INTEGER NOT NULL,
+            entry_name TEXT,
+            compress_type INTEGER,
+            compress_size INTEGER,
+            file_size INTEGER,
+            header_offset INTEGER,
+            data_offset INTEGER,
+            format TEXT,
+            width INTEGER,
+            height INTEGER,
+            is_spread BOOLEAN DEFAULT 0,
+            PRIMARY KEY (comic_id, page_index),
+            FOREIGN KEY (comic_id) REFERENCES comics (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_5(c):
+    # Optimized copy of a CBR/PDF (stored CBZ under cache/optimized), used while
+    # optimized_mtime_ns matches the original file
+    _ensure_column(c, 'comics', 'optimized_path', 'TEXT')
+    _ensure_column(c, 'comics', 'optimized_mtime_ns', 'INTEGER')
+
+def _migration_6(c):
+    # Partial content fingerprint (see scanner.content_fingerprint): finds files
+    # that moved while the app was closed, and duplicate copies
+    _ensure_column(c, 'comics', 'content_hash', 'TEXT')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comics_content_hash ON comics (content_hash)')
+
+def _migration_7(c):
+    # Result of the last integrity check ('ok', 'damaged', 'corrupt', 'unreadable') and the
+    # file mtime it applies to; a newer file is checked again
+    _ensure_column(c, 'comics', 'integrity_status', 'TEXT')
+    _ensure_column(c, 'comics', 'integrity_error', 'TEXT')
+    _ensure_column(c, 'comics', 'integrity_mtime_ns', 'INTEGER')
+
+MIGRATIONS = [_migration_1, _migration_2, _migration_3, _migration_4, _migration_5, _migration_6,
+              _migration_7]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def _migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        with transaction() as c:
+            MIGRATIONS[number - 1](c)
+            c.execute(f'PRAGMA user_version = {number}')
+        log.info("Database migrated to schema version %d", number)
+
+# --- Search ---
+def rebuild_search_index(c=None):
+    """Re-indexes everything from the source tables. page_actions has no
+    INTEGER PRIMARY KEY, so run this after a VACUUM (which may renumber rowids).
+    c: a cursor inside the caller's transaction (migrations); without one the
+    rebuild runs in its own."""
+    if c is None:
+        with transaction() as conn:
+            rebuild_search_index(conn)
+        return
+    for fts in ('comics_fts', 'page_notes_fts', 'page_markers_fts'):
+        c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def _fts_query(text):
+    """Turns user input into an FTS5 query: every word must match, as a prefix"""
+    words = [w.replace('"', '') for w in text.split()]
+    return ' '.join(f'"{w}"*' for w in words if w)
+
+def search(text, limit=50):
+    """Ranked matches in titles, page notes and marker text.
+
+    Returns dicts with kind ('title', 'note' or 'marker'), comic_id,
+    page_number (None for titles), marker_id, title and a highlighted snippet.
+    """
+    query = _fts_query(text)
+    if not query:
+        return []
+    conn = get_connection()
+    # Each table returns its own top matches (FTS5 sorts by its rank column
+    # internally), snippets are only built for those rows
+    titles = conn.execute('''
+        SELECT 'title' AS kind, c.id AS comic_id, NULL AS page_number, NULL AS marker_id, c.title,
+               highlight(comics_fts, 0, '[', ']') AS snippet, comics_fts.rank AS rank
+        FROM comics_fts JOIN comics c ON c.id = comics_fts.rowid
+        WHERE comics_fts MATCH ?
+        ORDER BY comics_fts.rank
+        LIMIT ?
+    ''', (query, limit)).fetchall()
+    notes = conn.execute('''
+        SELECT 'note' AS kind, pa.comic_id, pa.page_number, NULL AS marker_id, c.title,
+               snippet(page_notes_fts, 0, '[', ']', '...', 12) AS snippet, page_notes_fts.rank AS rank
+        FROM page_notes_fts
+        JOIN page_actions pa ON pa.rowid = page_notes_fts.rowid
+        JOIN comics c ON c.id = pa.comic_id
+        WHERE page_notes_fts MATCH ?
+        ORDER BY page_notes_fts.rank
+        LIMIT ?
+    ''', (query, limit)).fetchall()
+    markers = conn.execute('''
+        SELECT 'marker' AS kind, c.id AS comic_id, pm.page_number, pm.id AS marker_id, c.title,
+               snippet(page_markers_fts, 0, '[', ']', '...', 12) AS snippet, page_markers_fts.rank AS rank
+        FROM page_markers_fts
+        JOIN page_markers pm ON pm.id = page_markers_fts.rowid
+        JOIN comics c ON c.id = pm.comic_id
+        WHERE page_markers_fts MATCH ?
+        ORDER BY page_markers_fts.rank
+        LIMIT ?
+    ''', (query, limit)).fetchall()
+
+    results = [dict(r) for r in titles]
+    for r in results:
+        # bm25 is negative, lower is better; title hits are weighted up
+        r['rank'] *= 2
+    results += [dict(r) for r in notes] + [dict(r) for r in markers]
+    results.sort(key=lambda r: r['rank'])
+    return results[:limit]
 
 # --- Marker Helpers ---
 def add_marker(comic_id, page, x, y, content):
-    conn = get_connection()
-    conn.execute('INSERT INTO page_markers (comic_id, page_number, x, y, content, created_at) VALUES (?, ?, ?, ?, ?, ?)', 
-                 (comic_id, page, x, y, content, datetime.now()))
-    conn.commit()
-    marker_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
-    conn.close()
-    return marker_id
+    with transaction() as conn:
+        cur = conn.execute('INSERT INTO page_markers (comic_id, page_number, x, y, content, created_at) VALUES (?, ?, ?, ?, ?, ?)', 
+                           (comic_id, page, x, y, content, datetime.now()))
+        return cur.lastrowid
 
 def get_markers(comic_id):
-    conn = get_connection()
-    rows = conn.execute('SELECT * FROM page_markers WHERE comic_id = ?', (comic_id,)).fetchall()
-    conn.close()
+    rows = get_connection().execute('SELECT * FROM page_markers WHERE comic_id = ?', (comic_id,)).fetchall()
     return [dict(r) for r in rows]
 
 def delete_marker(marker_id):
-    conn = get_connection()
-    conn.execute('DELETE FROM page_markers WHERE id = ?', (marker_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM page_markers WHERE id = ?', (marker_id,))
 
 def update_marker_position(marker_id, x, y):
-    conn = get_connection()
-    conn.execute('UPDATE page_markers SET x = ?, y = ? WHERE id = ?', (x, y, marker_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('UPDATE page_markers SET x = ?, y = ? WHERE id = ?', (x, y, marker_id))
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def get_scan_fingerprints(root):
+    """Returns {file_path: (id, size_bytes, mtime_ns, content_hash)} for comics at or under root"""
+    prefix = root.rstrip(os.sep) + os.sep
+    rows = get_connection().execute(
+        'SELECT id, file_path, size_bytes, mtime_ns, content_hash FROM comics '
+        'WHERE file_path = ? OR substr(file_path, 1, ?) = ?',
+        (root, len(prefix), prefix)
+    ).fetchall()
+    return {r['file_path']: (r['id'], r['size_bytes'], r['mtime_ns'], r['content_hash']) for r in rows}
 
-def upsert_comic(file_path, title, fmt, size):
+def get_comics_by_content_hash(content_hashes):
+    """Returns {content_hash: [(id, file_path, title)]} for the given hashes"""
+    found = {}
     conn = get_connection()
-    c = conn.cursor()
-    try:
-        now = datetime.now()
-        c.execute('''
-            INSERT INTO comics (file_path, title, format, size_bytes, added_at)
-            VALUES (?, ?, ?, ?, ?)
+    hashes = list(content_hashes)
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        rows = conn.execute(
+            f"SELECT id, file_path, title, content_hash FROM comics WHERE content_hash IN ({', '.join('?' * len(chunk))})",
+            chunk
+        ).fetchall()
+        for r in rows:
+            found.setdefault(r['content_hash'], []).append((r['id'], r['file_path'], r['title']))
+    return found
+
+def get_duplicates():
+    """Groups of two or more comics with the same size and content fingerprint"""
+    rows = get_connection().execute('''
+        SELECT c.* FROM comics c
+        JOIN (SELECT content_hash, size_bytes FROM comics WHERE content_hash IS NOT NULL
+              GROUP BY content_hash, size_bytes HAVING COUNT(*) > 1) d
+          ON c.content_hash = d.content_hash AND c.size_bytes = d.size_bytes
+        ORDER BY c.size_bytes DESC, c.content_hash, c.added_at, c.id
+    ''').fetchall()
+    groups = {}
+    for r in rows:
+        groups.setdefault((r['content_hash'], r['size_bytes']), []).append(dict(r))
+    return [{'content_hash': content_hash, 'size_bytes': size, 'comics': comics}
+            for (content_hash, size), comics in groups.items()]
+
+def apply_scan(upserts, removed_ids, moves=()):
+    """Writes a scan's results in a single transaction.
+
+    upserts: iterable of (file_path, title, format, size_bytes, mtime_ns, content_hash)
+    removed_ids: comics whose files are gone
+    moves: (comic_id, new_file_path, title) for comics found under a new path;
+        they keep their id and the upsert for new_file_path then applies to them
+    """
+    now = datetime.now()
+    with transaction() as conn:
+        conn.executemany('UPDATE comics SET file_path = ?, title = ? WHERE id = ?',
+                         [(path, title, comic_id) for comic_id, path, title in moves])
+        # A changed fingerprint resets page_count so the indexer picks the comic up again,
+        # and drops the optimized copy made from the old file (optimizer.prune deletes it).
+        # cover_cached_path is kept: its key no longer matches, and build_cover deletes
+        # the old JPEG once the new one is written
+        conn.executemany('''
+            INSERT INTO comics (file_path, title, format, size_bytes, mtime_ns, content_hash, added_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(file_path) DO UPDATE SET
-            size_bytes = excluded.size_bytes
-        ''', (file_path, title, fmt, size, now))
-        conn.commit()
-        return c.lastrowid
-    except Exception as e:
-        print(f"Error upserting comic: {e}")
-    finally:
-        conn.close()
+            page_count = CASE WHEN size_bytes = excluded.size_bytes
+                AND (mtime_ns IS NULL OR mtime_ns = excluded.mtime_ns) THEN page_count ELSE 0 END,
+            optimized_path = CASE WHEN size_bytes = excluded.size_bytes
+                AND (mtime_ns IS NULL OR mtime_ns = excluded.mtime_ns) THEN optimized_path ELSE NULL END,
+            size_bytes = excluded.size_bytes,
+            mtime_ns = excluded.mtime_ns,
+            content_hash = COALESCE(excluded.content_hash, CASE WHEN size_bytes = excluded.size_bytes
+                AND mtime_ns = excluded.mtime_ns THEN content_hash END)
+        ''', [(path, title, fmt, size, mtime_ns, content_hash, now)
+              for path, title, fmt, size, mtime_ns, content_hash in upserts])
 
-def update_progress(comic_id, page):
+        # Collections, actions and markers go with the comic (ON DELETE CASCADE)
+        conn.executemany('DELETE FROM comics WHERE id = ?', [(comic_id,) for comic_id in removed_ids])
+
+def relocate_comics(src, dest):
+    """Re-points comics at src (a file, or everything under a folder) to dest,
+    keeping their ids and therefore progress, collections, actions and markers.
+    Returns the ids that moved."""
+    prefix = src.rstrip(os.sep) + os.sep
+    with transaction() as conn:
+        rows = conn.execute(
+            'SELECT id, file_path FROM comics WHERE file_path = ? OR substr(file_path, 1, ?) = ?',
+            (src, len(prefix), prefix)
+        ).fetchall()
+        for r in rows:
+            new_path = dest + r['file_path'][len(src):]
+            # A row may already exist for the destination (e.g. indexed before the move event)
+            conn.execute('DELETE FROM comics WHERE file_path = ?', (new_path,))
+            conn.execute('UPDATE comics SET file_path = ? WHERE id = ?', (new_path, r['id']))
+    return [r['id'] for r in rows]
+
+def get_comic_ids_by_paths(paths):
     conn = get_connection()
-    c = conn.cursor()
-    status = 'reading'
-    now = datetime.now()
-    c.execute('UPDATE comics SET current_page = ?, status = ?, last_read_at = ? WHERE id = ?', 
-              (page, status, now, comic_id))
-    conn.commit()
-    conn.close()
+    ids = []
+    for path in paths:
+        row = conn.execute('SELECT id FROM comics WHERE file_path = ?', (path,)).fetchone()
+        if row:
+            ids.append(row['id'])
+    return ids
+
+def get_comics_by_size(size_bytes):
+    rows = get_connection().execute('SELECT * FROM comics WHERE size_bytes = ?', (size_bytes,)).fetchall()
+    return [dict(r) for r in rows]
+
+def add_library_root(path):
+    with transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO library_roots (path, added_at) VALUES (?, ?)', (path, datetime.now()))
+
+def get_library_roots():
+    rows = get_connection().execute('SELECT path FROM library_roots').fetchall()
+    return [r['path'] for r in rows]
+
+def get_comic(comic_id):
+    row = get_connection().execute('SELECT * FROM comics WHERE id = ?', (comic_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_all_comics():
+    rows = get_connection().execute('SELECT * FROM comics ORDER BY title ASC').fetchall()
+    return [dict(r) for r in rows]
+
+# Sort key -> (SQL expression, descending). Each expression has a matching
+# (expression, id) index so keyset pages are index range scans.
+LIBRARY_SORTS = {
+    'title': ('title COLLATE NOCASE', False),
+    'added': ('added_at', True),
+    'last_read': ('last_read_at', True),
+    # Last read, or added for unread comics; what the library's "recent" view shows
+    'recent': ('COALESCE(last_read_at, added_at)', True),
+}
+
+def query_library(sort='title', formats=None, status=None, collection_id=None,
+                  read_since=None, limit=None, after=None):
+    """Filtered, sorted slice of the library using keyset pagination.
+
+    after: (sort_value, id) of the last row of the previous page.
+    Returns (rows, after) where after is the cursor for the next page, or None
+    when there are no more rows.
+    """
+    expr, desc = LIBRARY_SORTS[sort]
+    where, params = [], []
+    if formats:
+        where.append(f"format IN ({', '.join('?' * len(formats))})")
+        params.extend(formats)
+    if status:
+        where.append('status = ?')
+        params.append(status)
+    if collection_id is not None:
+        where.append('id IN (SELECT comic_id FROM collection_items WHERE collection_id = ?)')
+        params.append(collection_id)
+    if read_since is not None:
+        where.append('last_read_at >= ?')
+        params.append(read_since)
+    if sort == 'last_read':
+        where.append('last_read_at IS NOT NULL')
+    if after is not None:
+        op = '<' if desc else '>'
+        # Written as a range on the sort expression so SQLite seeks the index
+        where.append(f'{expr} {op}= ? AND ({expr} {op} ? OR id {op} ?)')
+        params.extend([after[0], after[0], after[1]])
+
+    direction = 'DESC' if desc else 'ASC'
+    sql = f'SELECT *, {expr} AS sort_value FROM comics'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY {expr} {direction}, id {direction}'
+    if limit is not None:
+        # One extra row tells whether another page exists
+        sql += ' LIMIT ?'
+        params.append(limit + 1)
+
+    rows = [dict(r) for r in get_connection().execute(sql, params).fetchall()]
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = (rows[-1]['sort_value'], rows[-1]['id'])
+    for r in rows:
+        del r['sort_value']
+    return rows, next_after
+
+def get_unindexed_comic_ids():
+    """Comics that still need a page count, manifest or cover (new, changed or never opened)"""
+    rows = get_connection().execute(
+        'SELECT id FROM comics WHERE page_count = 0 OR cover_cached_path IS NULL OR manifest_mtime_ns IS NULL'
+    ).fetchall()
+    return [r['id'] for r in rows]
+
+def set_page_count(comic_id, page_count):
+    with transaction() as conn:
+        conn.execute('UPDATE comics SET page_count = ? WHERE id = ?', (page_count, comic_id))
+
+PAGE_COLUMNS = ('entry_name', 'compress_type', 'compress_size', 'file_size', 'header_offset',
+                'data_offset', 'format', 'width', 'height', 'is_spread')
+
+def set_pages(comic_id, mtime_ns, pages):
+    """Replaces a comic's page manifest and its page count.
+
+    mtime_ns: modification time of the file the manifest was read from
+    pages: dicts keyed by PAGE_COLUMNS, in reading order
+    """
+    with transaction() as conn:
+        conn.execute('DELETE FROM pages WHERE comic_id = ?', (comic_id,))
+        conn.executemany(
+            f"INSERT INTO pages (comic_id, page_index, {', '.join(PAGE_COLUMNS)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(PAGE_COLUMNS))})",
+            [(comic_id, i) + tuple(page.get(column) for column in PAGE_COLUMNS) for i, page in enumerate(pages)]
+        )
+        conn.execute('UPDATE comics SET page_count = ?, manifest_mtime_ns = ? WHERE id = ?',
+                     (len(pages), mtime_ns, comic_id))
+
+def get_pages(comic_id):
+    rows = get_connection().execute(
+        'SELECT * FROM pages WHERE comic_id = ? ORDER BY page_index', (comic_id,)
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+def set_optimized(comic_id, path, source_mtime_ns):
+    with transaction() as conn:
+        conn.execute('UPDATE comics SET optimized_path = ?, optimized_mtime_ns = ? WHERE id = ?',
+                     (path, source_mtime_ns, comic_id))
+
+def clear_optimized(comic_id):
+    with transaction() as conn:
+        conn.execute('UPDATE comics SET optimized_path = NULL, optimized_mtime_ns = NULL WHERE id = ?',
+                     (comic_id,))
+
+def get_optimized_paths():
+    rows = get_connection().execute('SELECT optimized_path FROM comics WHERE optimized_path IS NOT NULL').fetchall()
+    return [r['optimized_path'] for r in rows]
+
+def set_integrity(comic_id, status, error, mtime_ns):
+    with transaction() as conn:
+        conn.execute('UPDATE comics SET integrity_status = ?, integrity_error = ?, integrity_mtime_ns = ? WHERE id = ?',
+                     (status, error, mtime_ns, comic_id))
+
+def get_integrity_problems():
+    """Comics whose last check failed, whether or not the file changed since"""
+    rows = get_connection().execute('''
+        SELECT id, file_path, title, format, mtime_ns, integrity_status, integrity_error, integrity_mtime_ns
+        FROM comics WHERE integrity_status IS NOT NULL AND integrity_status != 'ok'
+        ORDER BY title COLLATE NOCASE, id
+    ''').fetchall()
+    return [dict(r) for r in rows]
+
+def get_unchecked_comic_ids(stale_only=False):
+    """Comics never checked or changed since their last check; with stale_only,
+    just the changed ones"""
+    where = 'integrity_mtime_ns IS NOT NULL AND integrity_mtime_ns != mtime_ns'
+    if not stale_only:
+        where = f'integrity_mtime_ns IS NULL OR ({where})'
+    rows = get_connection().execute(f'SELECT id FROM comics WHERE {where}').fetchall()
+    return [r['id'] for r in rows]
+
+def set_cover_cached_path(comic_id, path):
+    with transaction() as conn:
+        conn.execute('UPDATE comics SET cover_cached_path = ? WHERE id = ?', (path, comic_id))
+
+def update_progress(comic_id, page):
+    with transaction() as conn:
+        conn.execute('UPDATE comics SET current_page = ?, status = ?, last_read_at = ? WHERE id = ?', 
+                     (page, 'reading', datetime.now(), comic_id))
+
+def save_progress(updates):
+    """Writes many progress updates in one transaction. updates: {comic_id: (page, read_at)}"""
+    with transaction() as conn:
+        conn.executemany('UPDATE comics SET current_page = ?, status = ?, last_read_at = ? WHERE id = ?',
+                         [(page, 'reading', read_at, comic_id) for comic_id, (page, read_at) in updates.items()])
 
 def rename_comic(comic_id, new_title):
-    conn = get_connection()
-    conn.execute('UPDATE comics SET title = ? WHERE id = ?', (new_title, comic_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('UPDATE comics SET title = ? WHERE id = ?', (new_title, comic_id))
 
 def delete_comic(comic_id):
-    conn = get_connection()
-    conn.execute('DELETE FROM comics WHERE id = ?', (comic_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM comics WHERE id = ?', (comic_id,))
 
 # --- Collection Helpers ---
 def create_collection(name):
-    conn = get_connection()
     try:
-        conn.execute('INSERT INTO collections (name, created_at) VALUES (?, ?)', (name, datetime.now()))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute('INSERT INTO collections (name, created_at) VALUES (?, ?)', (name, datetime.now()))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def add_to_collection(collection_id, comic_id):
-    conn = get_connection()
     try:
-        conn.execute('INSERT OR IGNORE INTO collection_items (collection_id, comic_id, added_at) VALUES (?, ?, ?)', 
-                     (collection_id, comic_id, datetime.now()))
-        conn.commit()
-    finally:
-        conn.close()
+        with transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO collection_items (collection_id, comic_id, added_at) VALUES (?, ?, ?)', 
+                         (collection_id, comic_id, datetime.now()))
+        return True
+    except sqlite3.IntegrityError:
+        # Unknown collection or comic
+        return False
 
 def rename_collection(collection_id, name):
-    conn = get_connection()
     try:
-        conn.execute('UPDATE collections SET name = ? WHERE id = ?', (name, collection_id))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute('UPDATE collections SET name = ? WHERE id = ?', (name, collection_id))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def delete_collection(collection_id):
-    conn = get_connection()
-    # Manual cascade because PRAGMA foreign_keys might be off
-    conn.execute('DELETE FROM collection_items WHERE collection_id = ?', (collection_id,))
-    conn.execute('DELETE FROM collections WHERE id = ?', (collection_id,))
-    conn.commit()
-    conn.close()
+    # collection_items rows go with it (ON DELETE CASCADE)
+    with transaction() as conn:
+        conn.execute('DELETE FROM collections WHERE id = ?', (collection_id,))
 
 def get_collections_with_counts():
-    conn = get_connection()
-    rows = conn.execute('''
+    rows = get_connection().execute('''
         SELECT c.*, COUNT(ci.comic_id) as count 
         FROM collections c 
         LEFT JOIN collection_items ci ON c.id = ci.collection_id 
         GROUP BY c.id
     ''').fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 def get_collection_items(collection_id):
-    conn = get_connection()
-    rows = conn.execute('''
+    rows = get_connection().execute('''
         SELECT c.* 
         FROM comics c 
         JOIN collection_items ci ON c.id = ci.comic_id 
         WHERE ci.collection_id = ?
         ORDER BY c.title
     ''', (collection_id,)).fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 # --- Page Action Helpers ---
 def set_page_action(comic_id, page, is_fav=None, note=None):
-    conn = get_connection()
-    
-    # Check existing
-    curr = conn.execute('SELECT * FROM page_actions WHERE comic_id = ? AND page_number = ?', (comic_id, page)).fetchone()
-    
-    new_fav = is_fav if is_fav is not None else (curr['is_favorite'] if curr else 0)
-    new_note = note if note is not None else (curr['note'] if curr else '')
-    
-    conn.execute('''
-        INSERT INTO page_actions (comic_id, page_number, is_favorite, note, updated_at)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(comic_id, page_number) DO UPDATE SET
-        is_favorite = excluded.is_favorite,
-        note = excluded.note,
-        updated_at = excluded.updated_at
-    ''', (comic_id, page, new_fav, new_note, datetime.now()))
-    
-    conn.commit()
-    conn.close()
+    # One statement: a None argument keeps the stored value (or the default for a new row)
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO page_actions (comic_id, page_number, is_favorite, note, updated_at)
+            VALUES (?, ?, COALESCE(?, 0), COALESCE(?, ''), ?)
+            ON CONFLICT(comic_id, page_number) DO UPDATE SET
+            is_favorite = COALESCE(?, is_favorite),
+            note = COALESCE(?, note),
+            updated_at = excluded.updated_at
+        ''', (comic_id, page, is_fav, note, datetime.now(), is_fav, note))
 
 def get_page_actions(comic_id):
-    conn = get_connection()
-    rows = conn.execute('SELECT * FROM page_actions WHERE comic_id = ?', (comic_id,)).fetchall()
-    conn.close()
+    rows = get_connection().execute('SELECT * FROM page_actions WHERE comic_id = ?', (comic_id,)).fetchall()
     return {r['page_number']: dict(r) for r in rows}
 
 if __name__ == '__main__':
@@ -0,0 +1,166 @@
+"""Optional process pool for CPU-heavy page work.
+
+pdfium renders under a process-wide lock and Pillow's resize/encode holds
+the GIL for part of its work, so in one process concurrent page requests
+largely take turns. With a pool configured (--decode-workers N), ComicReader
+hands PDF rendering, page resizing, thumbnails and inflating deflated CBZ
+entries to N worker processes. Each worker keeps its own open readers keyed
+by file, and large results come back through shared memory instead of being
+pickled through the pool's pipe.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+log = logging.getLogger(__name__)
+
+# Worker processes; 0 keeps all page work in the serving process
+DECODE_WORKERS = int(os.environ.get('KUBRICK_DECODE_WORKERS', 0))
+# Results smaller than this are cheaper to pickle than to map
+SHM_MIN_BYTES = 64 * 1024
+# Open readers per worker process
+WORKER_READERS = 8
+# Windows frees a segment with its last handle, so a worker keeps its most
+# recent ones open until the parent has surely attached
+_WINDOWS_KEEP = 32
+
+# The pool in use, set by configure(); None when page work stays in-process
+POOL = None
+
+class DecodePool:
+    def __init__(self, workers, log_level=None):
+        self.workers = max(1, workers)
+        self.log_level = log_level
+        self._executor = None
+        self._lock = threading.Lock()
+        # Forked children (e.g. a process index pool) must not use the parent's pool
+        self._pid = os.getpid()
+        self.calls = 0
+        self.shm_transfers = 0
+        self.errors = 0
+
+    def usable(self):
+        return os.getpid() == self._pid
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the server process has threads holding locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker, initargs=(self.log_level,))
+            return self._executor
+
+    def start(self):
+        """Spawns the workers now rather than on the first page"""
+        executor = self._get_executor()
+        for future in [executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def call(self, file_path, method, *args):
+        """Runs ComicReader(file_path).method(*args) in a worker and returns its result"""
+        try:
+            result = self._get_executor().submit(_run, file_path, method, args).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. a crash in a native library); start over next time
+            with self._lock:
+                self._executor = None
+                self.errors += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        with self._lock:
+            self.calls += 1
+            if isinstance(result, tuple):
+                self.shm_transfers += 1
+        return _receive(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'calls': self.calls,
+                'shm_transfers': self.shm_transfers,
+                'errors': self.errors,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def configure(workers, log_level=None):
+    """Installs a pool of worker processes as POOL (none for workers <= 0)"""
+    global POOL
+    if POOL is not None:
+        POOL.shutdown()
+    POOL = DecodePool(workers, log_level) if workers > 0 else None
+    return POOL
+
+def _receive(result):
+    if not isinstance(result, tuple):
+        return result
+    name, size = result
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+
+# --- Worker process side ---
+_readers = OrderedDict()  # file_path -> (mtime_ns, ComicReader)
+_kept_segments = deque()
+
+def _init_worker(log_level):
+    if log_level:
+        import logs
+        logs.configure(log_level)
+
+def _ping():
+    return os.getpid()
+
+def _worker_reader(file_path):
+    from reader import ComicReader
+
+    mtime_ns = os.stat(file_path).st_mtime_ns
+    entry = _readers.pop(file_path, None)
+    if entry is not None and entry[0] != mtime_ns:
+        entry[1].close()
+        entry = None
+    if entry is None:
+        entry = (mtime_ns, ComicReader(file_path))
+    _readers[file_path] = entry
+    while len(_readers) > WORKER_READERS:
+        _, (_, evicted) = _readers.popitem(last=False)
+        evicted.close()
+    return entry[1]
+
+def _run(file_path, method, args):
+    return _send(getattr(_worker_reader(file_path), method)(*args))
+
+def _send(data):
+    if data is None or len(data) < SHM_MIN_BYTES:
+        return data
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    result = (shm.name, len(data))
+    if os.name == 'nt':
+        _kept_segments.append(shm)
+        while len(_kept_segments) > _WINDOWS_KEEP:
+            _kept_segments.popleft().close()
+    else:
+        # The parent unlinks it once copied; stop this process's resource
+        # tracker from reporting (and removing) it as leaked
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        shm.close()
+    return result
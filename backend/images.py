@@ -0,0 +1,75 @@
+import os
+from io import BytesIO
+
+# Output formats the page endpoints can encode to
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png'),
+}
+
+EXT_MIMETYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+def mimetype_for_name(name):
+    """Content type of an archive entry, judged by its extension"""
+    return EXT_MIMETYPES.get(os.path.splitext(name)[1].lower(), 'application/octet-stream')
+
+def mimetype_for_format(fmt):
+    return FORMATS[fmt][1]
+
+def encode(image, fmt='jpeg', quality=85):
+    """Encodes a PIL image with Pillow's native codecs and returns the bytes"""
+    pil_format = FORMATS[fmt][0]
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    buf = BytesIO()
+    if pil_format == 'PNG':
+        image.save(buf, pil_format, compress_level=1)
+    elif pil_format == 'WEBP':
+        image.save(buf, pil_format, quality=quality, method=4)
+    else:
+        image.save(buf, pil_format, quality=quality, optimize=True)
+    return buf.getvalue()
+
+# PIL format name -> output format key
+PIL_FORMATS = {pil_format: fmt for fmt, (pil_format, _) in FORMATS.items()}
+
+def decode(data):
+    # Imported here so Pillow loads on the first image, not at startup
+    from PIL import Image
+    return Image.open(BytesIO(data))
+
+def resize(data, width=None, height=None, fmt=None, quality=85):
+    """Scales encoded image bytes to fit within width x height (never upscaling)
+    and re-encodes them. fmt=None keeps the source format.
+    """
+    image = decode(data)
+    source_fmt = PIL_FORMATS.get(image.format, 'jpeg')
+    fmt = fmt or source_fmt
+
+    box = (width or image.width, height or image.height)
+    if image.width <= box[0] and image.height <= box[1] and fmt == source_fmt:
+        # Already small enough and in the right format
+        return data
+    # JPEG can decode straight at 1/2, 1/4 or 1/8 scale, much cheaper than a full decode
+    image.draft('RGB', (width or 1, height or 1))
+    if image.width > box[0] or image.height > box[1]:
+        image.thumbnail(box)
+    return encode(image, fmt, quality)
+
+def probe(data):
+    """(format, width, height) from an image's header, None if it cannot be read.
+    Only the header is parsed, so the first few KB of the file are usually enough."""
+    try:
+        image = decode(data)
+        return PIL_FORMATS.get(image.format, (image.format or '').lower()), image.width, image.height
+    except Exception:
+        return None
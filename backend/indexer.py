@@ -0,0 +1,56 @@
+import logging
+import os
+
+import covers
+import database
+import integrity
+import jobs
+import metrics
+from reader import ComicReader
+
+log = logging.getLogger(__name__)
+
+# Pool used to index comics in the background. Archive extraction, pdfium and
+# Pillow release the GIL, so threads are the default; 'process' is available
+# for CPU-bound libraries (many PDFs).
+INDEX_WORKERS = int(os.environ.get('KUBRICK_INDEX_WORKERS', os.cpu_count() or 4))
+INDEX_POOL = os.environ.get('KUBRICK_INDEX_POOL', 'thread')
+
+def stored_manifest(comic):
+    """The manifest argument for ComicReader from a comics row, None if never built"""
+    if comic['manifest_mtime_ns'] is None:
+        return None
+    return comic['manifest_mtime_ns'], database.get_pages(comic['id'])
+
+def index_comic(comic_id):
+    """Fills page_count, the page manifest and the cover thumbnail of a comic.
+    Returns True on success."""
+    with metrics.INDEX_SECONDS.time():
+        return _index_comic(comic_id)
+
+def _index_comic(comic_id):
+    comic = database.get_comic(comic_id)
+    if not comic:
+        return False
+
+    reader = ComicReader(comic['file_path'], manifest=stored_manifest(comic))
+    try:
+        if integrity.BROKEN.record_reader(comic, reader):
+            return False
+        page_count = reader.get_page_count()
+        if page_count == 0:
+            return False
+        if not reader.has_manifest:
+            mtime_ns, pages = reader.build_manifest()
+            database.set_pages(comic_id, mtime_ns, pages)
+        elif comic['page_count'] != page_count:
+            database.set_page_count(comic_id, page_count)
+        return covers.get_cover(comic_id, reader) is not None
+    finally:
+        reader.close()
+
+class Indexer(jobs.ComicJobs):
+    def __init__(self, workers=INDEX_WORKERS, pool=INDEX_POOL):
+        super().__init__(index_comic, workers, 'indexer', pool)
+
+INDEXER = Indexer()
@@ -0,0 +1,130 @@
+"""Integrity checks and the negative cache for comics that cannot be read.
+
+A broken archive, or a CBR without UnRAR, otherwise fails slowly on every
+page and cover request. Results are recorded in the comics table (status,
+error and the file mtime they apply to). Comics that do not open at all
+('corrupt', 'unreadable') are also kept in memory by BROKEN, so later
+requests fail at once with UnreadableComic until the file changes.
+
+The IntegrityChecker job reads whole files (CRCs, every PDF page). A comic
+that opens but has bad entries is recorded as 'damaged' and stays readable:
+its good pages are still served.
+"""
+import logging
+import os
+import threading
+
+import database
+import jobs
+import metrics
+from reader import ComicReader
+
+log = logging.getLogger(__name__)
+
+# Files checked concurrently; zlib CRC checks and unrar run outside the GIL
+INTEGRITY_WORKERS = int(os.environ.get('KUBRICK_INTEGRITY_WORKERS', os.cpu_count() or 4))
+
+class UnreadableComic(Exception):
+    def __init__(self, comic_id, status, error):
+        super().__init__(error)
+        self.comic_id = comic_id
+        self.status = status
+        self.error = error
+
+# Statuses of comics that did not open; only these fail requests early
+BLOCKING = ('corrupt', 'unreadable')
+
+class BrokenComics:
+    """comic_id -> (file_path, mtime_ns, status, error) of comics known not to
+    open. An entry holds while the file's mtime is unchanged."""
+
+    def __init__(self):
+        self._entries = None
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def _load(self):
+        # Caller holds the lock
+        if self._entries is None:
+            self._entries = {
+                c['id']: (c['file_path'], c['integrity_mtime_ns'], c['integrity_status'], c['integrity_error'])
+                for c in database.get_integrity_problems()
+                if c['integrity_status'] in BLOCKING and c['integrity_mtime_ns'] == c['mtime_ns']
+            }
+        return self._entries
+
+    def check(self, comic_id):
+        """Raises UnreadableComic when comic_id is known to be broken"""
+        with self._lock:
+            entry = self._load().get(comic_id)
+        if entry is None:
+            return
+        file_path, mtime_ns, status, error = entry
+        try:
+            changed = os.stat(file_path).st_mtime_ns != mtime_ns
+        except OSError:
+            changed = False
+        if changed:
+            # Replaced or repaired: let the next open try again
+            self.forget(comic_id)
+            return
+        with self._lock:
+            self.hits += 1
+        raise UnreadableComic(comic_id, status, error)
+
+    def record(self, comic, status, error, mtime_ns):
+        """Stores the result of opening or checking a comic; only a BLOCKING
+        status makes requests for it fail early"""
+        database.set_integrity(comic['id'], status, error, mtime_ns)
+        with self._lock:
+            entries = self._load()
+            if status in BLOCKING:
+                entries[comic['id']] = (comic['file_path'], mtime_ns, status, error)
+            else:
+                entries.pop(comic['id'], None)
+        if status != 'ok':
+            log.warning("Comic %s (%s) is %s: %s", comic['id'], comic['file_path'], status, error)
+
+    def record_reader(self, comic, reader):
+        """Records reader.error if the reader failed to open; returns that error"""
+        if reader.error:
+            self.record(comic, *reader.error, reader.mtime_ns)
+        return reader.error
+
+    def forget(self, comic_id):
+        with self._lock:
+            if self._entries is not None:
+                self._entries.pop(comic_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._load()), 'hits': self.hits}
+
+BROKEN = BrokenComics()
+
+def check_comic(comic_id):
+    """Reads a comic end to end and records the outcome. Returns its status."""
+    comic = database.get_comic(comic_id)
+    if not comic:
+        return None
+    reader = ComicReader(comic['file_path'])
+    try:
+        problem = reader.verify()
+        status, error = problem or ('ok', None)
+        BROKEN.record(comic, status, error, reader.mtime_ns)
+        return status
+    finally:
+        reader.close()
+
+class IntegrityChecker(jobs.ComicJobs):
+    """Checks comics on a thread pool; results are counted by status"""
+
+    def __init__(self, workers=INTEGRITY_WORKERS):
+        super().__init__(check_comic, workers, 'integrity')
+
+    def outcome(self, status):
+        status = status or 'missing'
+        metrics.INTEGRITY_CHECKS.inc(result=status)
+        return status
+
+CHECKER = IntegrityChecker()
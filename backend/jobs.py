@@ -0,0 +1,87 @@
+"""Background work over comics: the pool behind the indexer and the integrity checker.
+
+Comics are queued by id, each is run once at a time through fn(comic_id) on
+a thread (or process) pool, and progress is counted per batch: totals reset
+once everything queued has finished.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+log = logging.getLogger(__name__)
+
+class ComicJobs:
+    """Runs fn(comic_id) for queued comics. outcome() names what a result
+    counts as in status()['results']; anything but 'ok' counts as failed."""
+
+    def __init__(self, fn, workers, name, pool='thread'):
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.name = name
+        self.pool = pool
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._total = 0
+        self._done = 0
+        self._results = {}
+
+    def outcome(self, result):
+        return 'ok' if result else 'failed'
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.pool == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def submit(self, comic_ids):
+        """Queues comics, ignoring those already queued. Returns how many were added."""
+        futures = []
+        with self._lock:
+            executor = self._get_executor()
+            # Progress restarts once the previous batch has drained
+            if not self._queued:
+                self._total = self._done = 0
+                self._results = {}
+            for comic_id in comic_ids:
+                if comic_id in self._queued:
+                    continue
+                self._queued.add(comic_id)
+                self._total += 1
+                futures.append((comic_id, executor.submit(self.fn, comic_id)))
+        # Outside the lock: a future that already finished runs its callback
+        # right here, and _finish takes the lock
+        for comic_id, future in futures:
+            future.add_done_callback(lambda f, cid=comic_id: self._finish(cid, f))
+        return len(futures)
+
+    def _finish(self, comic_id, future):
+        try:
+            outcome = self.outcome(future.result())
+        except Exception as e:
+            log.error("Error in %s for comic %s: %s - %s", self.name, comic_id, type(e).__name__, e)
+            outcome = 'error'
+        with self._lock:
+            self._queued.discard(comic_id)
+            self._done += 1
+            self._results[outcome] = self._results.get(outcome, 0) + 1
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': bool(self._queued),
+                'done': self._done,
+                'total': self._total,
+                'failed': sum(n for outcome, n in self._results.items() if outcome != 'ok'),
+                'results': dict(self._results),
+                'workers': self.workers,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,47 @@
+import json
+import logging
+import os
+import sys
+
+# DEBUG, INFO, WARNING, ERROR or OFF; overridden by --log-level
+LOG_LEVEL = os.environ.get('KUBRICK_LOG_LEVEL', 'INFO')
+# 'text' for people, 'json' (one object per line) for log tooling
+LOG_FORMAT = os.environ.get('KUBRICK_LOG_FORMAT', 'text')
+
+# LogRecord attributes that are not user-supplied extra fields
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any extra={...} fields of the call"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Sets up the root logger on stderr, which Electron writes to backend.log"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if level.upper() == 'OFF':
+        logging.disable(logging.CRITICAL)
+        return
+
+    logging.disable(logging.NOTSET)
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(level.upper())
@@ -1,48 +1,198 @@
-from flask import Flask, jsonify, request, send_file
+import time
+# Start of the startup clock reported by /api/health
+_STARTED_AT = time.perf_counter()
+
+from flask import Flask, Response, jsonify, request, send_file
+from werkzeug.wsgi import wrap_file
 from flask_cors import CORS
-import sqlite3
+import atexit
+import hashlib
+import logging
 import os
 import io
+import base64
+import json
+import queue
+import threading
+from datetime import datetime, timedelta
 
+import covers
 import database
+import decodepool
+import indexer
+import integrity
+import logs
+import metrics
+import optimizer
 import scanner
-from reader import ComicReader
+import uploads
+import watcher
+import writebehind
+import images
+from cache import CACHE_DIR, BookCache, DiskCache, PageCache, ReaderCache
+from reader import ComicReader, FileSlice
 
 app = Flask(__name__)
 CORS(app)
 
-# In-memory cache for readers to avoid re-opening files constantly
+log = logging.getLogger('main')
+
+# Covers are revalidated with their ETag once this expires
+COVER_MAX_AGE = 24 * 60 * 60
+# Pages change only when their file does; the ETag covers that on revalidation
+PAGE_MAX_AGE = 7 * 24 * 60 * 60
+
+# Open readers, LRU-evicted (and closed) by count and estimated memory
 # Key: comic_id, Value: ComicReader instance
-READERS_CACHE = {}
+READERS_CACHE = ReaderCache()
+
+# Decoded pages shared by all readers; page turns are served from here
+PAGE_CACHE = PageCache()
+# Pages warmed ahead of the one being read
+READ_AHEAD = int(os.environ.get('KUBRICK_READ_AHEAD', 3))
+
+# Rendered PDF pages and resized page variants (thumbnails, screen-fit pages)
+RENDER_CACHE = DiskCache(
+    os.path.join(CACHE_DIR, 'renders'),
+    int(os.environ.get('KUBRICK_RENDER_CACHE_MB', 1024)) * 1024 * 1024,
+)
+
+# Solid CBRs, extracted whole on first read past the cover
+BOOK_CACHE = BookCache(
+    os.path.join(CACHE_DIR, 'books'),
+    int(os.environ.get('KUBRICK_BOOK_CACHE_MB', 2048)) * 1024 * 1024,
+)
+
+def _open_reader(comic_id):
+    comic = database.get_comic(comic_id)
+    if not comic:
+        return None
+    optimized = optimizer.optimized_path_for(comic)
+    if optimized:
+        # Stored pages already encoded at reading size; probed on open, no manifest
+        return ComicReader(optimized, page_cache=PAGE_CACHE, read_ahead=READ_AHEAD)
+    reader = ComicReader(comic['file_path'], page_cache=PAGE_CACHE, read_ahead=READ_AHEAD,
+                         render_cache=RENDER_CACHE, book_cache=BOOK_CACHE,
+                         manifest=indexer.stored_manifest(comic))
+    error = integrity.BROKEN.record_reader(comic, reader)
+    if error:
+        # Not cached: the next request fails fast through integrity.BROKEN instead
+        reader.close()
+        raise integrity.UnreadableComic(comic_id, *error)
+    return reader
 
 def get_reader_instance(comic_id):
+    """The open reader for a comic, None if there is no such comic. Raises
+    integrity.UnreadableComic for a comic whose file is known not to open."""
     comic_id = int(comic_id)
-    if comic_id in READERS_CACHE:
-        return READERS_CACHE[comic_id]
-    
-    conn = database.get_connection()
-    row = conn.execute('SELECT file_path FROM comics WHERE id = ?', (comic_id,)).fetchone()
-    conn.close()
-    
-    if not row:
+    integrity.BROKEN.check(comic_id)
+    return READERS_CACHE.get(comic_id, lambda: _open_reader(comic_id))
+
+@app.errorhandler(integrity.UnreadableComic)
+def _unreadable_comic(e):
+    return jsonify({'error': e.error, 'status': e.status, 'comic_id': e.comic_id}), 422
+
+# Live filesystem watch of the scanned folders
+WATCH_ENABLED = os.environ.get('KUBRICK_WATCH', '1') != '0'
+
+def _on_library_change(comic_ids, paths):
+    for comic_id in comic_ids:
+        READERS_CACHE.pop(comic_id)
+        integrity.BROKEN.forget(comic_id)
+    for path in paths:
+        PAGE_CACHE.invalidate(path)
+    indexer.INDEXER.submit(database.get_unindexed_comic_ids())
+    # Checked files that changed since are checked again
+    integrity.CHECKER.submit(database.get_unchecked_comic_ids(stale_only=True))
+
+WATCHER = watcher.LibraryWatcher(on_change=_on_library_change)
+
+def _scan_changed_ids(result):
+    """Comics of a scan result whose open readers no longer match their file"""
+    return result['removed_ids'] + result['moved_ids'] + result['updated_ids']
+
+def _catch_up_roots(roots):
+    """Applies changes made while the app was closed; unchanged files cost one stat each"""
+    for root in roots:
+        if os.path.isdir(root):
+            result = scanner.scan_directory(root)
+            _on_library_change(_scan_changed_ids(result), result['updated_paths'])
+
+# Page turns are coalesced per comic and committed in batches; the rest at exit
+PROGRESS = writebehind.ProgressBuffer()
+atexit.register(PROGRESS.stop)
+
+# Largest page /api/library will return
+LIBRARY_PAGE_MAX = 500
+
+def _encode_cursor(after):
+    if after is None:
         return None
-        
-    reader = ComicReader(row['file_path'])
-    READERS_CACHE[comic_id] = reader
-    return reader
+    return base64.urlsafe_b64encode(json.dumps(after).encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor):
+    value, comic_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return value, int(comic_id)
 
 @app.route('/api/library', methods=['GET'])
 def list_library():
-    conn = database.get_connection()
-    rows = conn.execute('SELECT * FROM comics ORDER BY title ASC').fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in rows])
+    """Lists the library. Optional: sort (title|added|last_read|recent),
+    format (comma separated), status, collection, read_within_days, and
+    limit/cursor for keyset pagination. Without limit or cursor the whole
+    (filtered) library is returned as a plain list."""
+    args = request.args
+    sort = args.get('sort', 'title')
+    if sort not in database.LIBRARY_SORTS:
+        return jsonify({'error': 'Unknown sort'}), 400
+
+    formats = [f for f in args.get('format', '').lower().split(',') if f]
+    read_since = None
+    read_within_days = args.get('read_within_days', type=int)
+    if read_within_days is not None:
+        read_since = datetime.now() - timedelta(days=read_within_days)
+
+    limit = args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, LIBRARY_PAGE_MAX))
+    cursor = args.get('cursor')
+    after = None
+    if cursor:
+        try:
+            after = _decode_cursor(cursor)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+        if limit is None:
+            limit = LIBRARY_PAGE_MAX
+
+    # Sorting and filtering by progress has to see pending page turns
+    PROGRESS.flush()
+    rows, next_after = database.query_library(
+        sort=sort,
+        formats=formats,
+        status=args.get('status'),
+        collection_id=args.get('collection', type=int),
+        read_since=read_since,
+        limit=limit,
+        after=after,
+    )
+    if limit is None:
+        return jsonify(rows)
+    return jsonify({'items': rows, 'next_cursor': _encode_cursor(next_after)})
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Prefix search over titles, page notes and markers: ?q=bat man&limit=20"""
+    q = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    if not q:
+        return jsonify([])
+    return jsonify(database.search(q, limit))
 
 @app.route('/api/scan', methods=['POST'])
 def scan_dir():
     data = request.json
     path = data.get('path')
-    print(f"API Received scan request for path: {repr(path)}")
+    log.info("Scan requested for %r", path)
     
     if not path:
         return jsonify({'error': 'No path provided'}), 400
@@ -50,57 +200,229 @@ def scan_dir():
     # Remove quotes if they somehow got included
     path = path.strip('"\'')
     
-    count = scanner.scan_directory(path)
-    return jsonify({'added': count})
+    result = scanner.scan_directory(path)
+    if os.path.isdir(path):
+        path = os.path.abspath(path)
+        database.add_library_root(path)
+        WATCHER.add_root(path)
+    # Drops stale readers and pages; page counts and covers are filled in the
+    # background, off the request path
+    _on_library_change(_scan_changed_ids(result), result['updated_paths'])
+    return jsonify(result)
+
+@app.route('/api/duplicates', methods=['GET'])
+def get_duplicates():
+    """Groups of comics whose files have the same content fingerprint"""
+    return jsonify(database.get_duplicates())
 
 @app.route('/api/comic/<comic_id>', methods=['GET'])
 def get_comic_meta(comic_id):
-    conn = database.get_connection()
-    row = conn.execute('SELECT * FROM comics WHERE id = ?', (comic_id,)).fetchone()
-    
-    if not row:
-        conn.close()
+    data = database.get_comic(comic_id)
+    if not data:
         return jsonify({'error': 'Not found'}), 404
-    
-    data = dict(row)
-    conn.close()
+    PROGRESS.overlay(data)
 
     # Lazy load page count if missing
     if data['page_count'] == 0:
-        reader = get_reader_instance(comic_id)
+        try:
+            reader = get_reader_instance(comic_id)
+        except integrity.UnreadableComic:
+            # integrity_status/integrity_error in the row say why
+            reader = None
         if reader:
             pc = reader.get_page_count()
             data['page_count'] = pc
-            # Update DB
-            c2 = database.get_connection()
-            c2.execute('UPDATE comics SET page_count = ? WHERE id = ?', (pc, comic_id))
-            c2.commit()
-            c2.close()
+            database.set_page_count(comic_id, pc)
 
     return jsonify(data)
 
+@app.route('/api/comic/<comic_id>/manifest', methods=['GET'])
+def get_comic_manifest(comic_id):
+    """Per-page format and pixel size, so the Reader can lay pages out before they load"""
+    comic = database.get_comic(comic_id)
+    if not comic:
+        return jsonify({'error': 'Not found'}), 404
+
+    reader = get_reader_instance(comic_id)
+    if not reader or reader.get_page_count() == 0:
+        return jsonify({'error': 'Reader error'}), 404
+    if reader.has_manifest:
+        pages = database.get_pages(comic['id'])
+    else:
+        mtime_ns, pages = reader.build_manifest()
+        database.set_pages(comic['id'], mtime_ns, pages)
+
+    return jsonify({
+        'page_count': len(pages),
+        'pages': [{
+            'index': i,
+            'format': page.get('format'),
+            'width': page.get('width'),
+            'height': page.get('height'),
+            'is_spread': bool(page.get('is_spread')),
+        } for i, page in enumerate(pages)],
+    })
+
+def _variant_args():
+    """The optional page variant of a request: fit within w x h, encode as fmt
+    at quality q (e.g. ?w=160&fmt=webp for thumbnails). Returns (kwargs, None)
+    or (None, error response)."""
+    width = request.args.get('w', type=int)
+    height = request.args.get('h', type=int)
+    quality = request.args.get('q', type=int)
+    fmt = request.args.get('fmt')
+    if fmt is not None and fmt not in images.FORMATS:
+        return None, (jsonify({'error': 'Unsupported format'}), 400)
+    if (width is not None and width <= 0) or (height is not None and height <= 0):
+        return None, (jsonify({'error': 'Invalid size'}), 400)
+    if quality is not None and not 1 <= quality <= 100:
+        return None, (jsonify({'error': 'Invalid quality'}), 400)
+    return {'width': width, 'height': height, 'fmt': fmt, 'quality': quality}, None
+
 @app.route('/api/comic/<comic_id>/page/<int:page_num>', methods=['GET'])
 def get_page_image(comic_id, page_num):
     reader = get_reader_instance(comic_id)
     if not reader:
         return jsonify({'error': 'Reader error'}), 404
-        
-    image_bytes = reader.get_page_data(page_num)
+
+    variant, error = _variant_args()
+    if error:
+        return error
+    width, height, fmt, quality = variant['width'], variant['height'], variant['fmt'], variant['quality']
+
+    mimetype = reader.get_page_mimetype(page_num, fmt)
+    etag = reader.page_etag(page_num, width=width, height=height, fmt=fmt, quality=quality)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = PAGE_MAX_AGE
+        return response
+
+    # Stored CBZ pages are streamed straight from the archive, no decompression or copies
+    span = None
+    if not (width or height or fmt):
+        span = reader.get_stored_span(page_num)
+    if span is not None:
+        response = Response(wrap_file(request.environ, FileSlice(reader.file_path, *span)),
+                            mimetype=mimetype, direct_passthrough=True)
+        response.content_length = span[1]
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = PAGE_MAX_AGE
+        return response.make_conditional(request, accept_ranges=True, complete_length=span[1])
+
+    image_bytes = reader.get_page_data(page_num, width=width, height=height, fmt=fmt, quality=quality)
     if image_bytes is None:
         return jsonify({'error': 'Page error'}), 404
-    
-    return send_file(io.BytesIO(image_bytes), mimetype='image/jpeg')
+
+    return send_file(io.BytesIO(image_bytes), mimetype=mimetype, etag=etag,
+                     max_age=PAGE_MAX_AGE, conditional=True)
+
+# Most pages one /pages request returns, and pages read ahead of the network
+PAGES_BATCH_MAX = 50
+PAGES_QUEUE_SIZE = 4
+
+def _offer(out, item, stop):
+    """Puts item on out unless stop is set first; False when stopped"""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _produce_pages(reader, start, count, variant, out, stop):
+    """Reads pages into out on a separate thread, so the next page is read
+    while the previous one is being sent"""
+    try:
+        for item in reader.iter_pages(start, count, **variant):
+            if not _offer(out, item, stop):
+                return
+    except Exception as e:
+        log.error("Error reading pages of %s: %s - %s", reader.file_path, type(e).__name__, e)
+    _offer(out, None, stop)
+
+def _page_parts(reader, start, count, variant, boundary):
+    out = queue.Queue(PAGES_QUEUE_SIZE)
+    stop = threading.Event()
+    threading.Thread(target=_produce_pages, args=(reader, start, count, variant, out, stop),
+                     name='pages', daemon=True).start()
+    try:
+        while True:
+            item = out.get()
+            if item is None:
+                break
+            index, data = item
+            headers = [
+                f'--{boundary}',
+                f'Content-Type: {reader.get_page_mimetype(index, variant["fmt"])}',
+                f'Content-Length: {len(data) if data is not None else 0}',
+                f'X-Page-Index: {index}',
+                f'ETag: "{reader.page_etag(index, **variant)}"',
+            ]
+            if data is None:
+                headers.append('X-Page-Error: 1')
+            yield ('\r\n'.join(headers) + '\r\n\r\n').encode('ascii')
+            if data:
+                yield data
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode('ascii')
+    finally:
+        # The client went away or the response is done; let the producer quit
+        stop.set()
+
+@app.route('/api/comic/<comic_id>/pages', methods=['GET'])
+def get_page_batch(comic_id):
+    """A run of pages in one multipart/mixed response: ?from=40&count=10, plus
+    the variant options of the page endpoint. Each part carries Content-Type,
+    Content-Length, X-Page-Index and the page's ETag; a page that cannot be
+    read is an empty part with X-Page-Error: 1."""
+    reader = get_reader_instance(comic_id)
+    if not reader:
+        return jsonify({'error': 'Reader error'}), 404
+
+    start = request.args.get('from', 0, type=int)
+    count = request.args.get('count', 10, type=int)
+    if start < 0 or count <= 0:
+        return jsonify({'error': 'Invalid range'}), 400
+    variant, error = _variant_args()
+    if error:
+        return error
+    count = min(count, PAGES_BATCH_MAX, reader.get_page_count() - start)
+    if count <= 0:
+        return jsonify({'error': 'Range not satisfiable'}), 416
+
+    etag = hashlib.sha1(''.join(
+        reader.page_etag(i, **variant) for i in range(start, start + count)).encode('ascii')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        boundary = f'kubrick-{etag[:16]}'
+        response = Response(_page_parts(reader, start, count, variant, boundary),
+                            mimetype=f'multipart/mixed; boundary={boundary}')
+        response.headers['X-Page-Count'] = str(count)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = PAGE_MAX_AGE
+    return response
 
 @app.route('/api/comic/<comic_id>/cover', methods=['GET'])
 def get_cover(comic_id):
-    # For now, just return page 0. In future, cache this.
-    return get_page_image(comic_id, 0)
+    integrity.BROKEN.check(int(comic_id))
+    cover = covers.get_cover(comic_id)
+    if cover is None:
+        return jsonify({'error': 'Cover error'}), 404
+
+    path, etag = cover
+    return send_file(path, mimetype='image/jpeg', etag=etag, max_age=COVER_MAX_AGE, conditional=True)
 
 @app.route('/api/comic/<comic_id>/progress', methods=['POST'])
 def update_progress(comic_id):
     data = request.json
     page = data.get('page', 0)
-    database.update_progress(comic_id, page)
+    PROGRESS.record(comic_id, page)
     return jsonify({'success': True})
 
 @app.route('/api/comic/<comic_id>/rename', methods=['PUT'])
@@ -114,6 +436,14 @@ def rename_comic(comic_id):
 
 @app.route('/api/comic/<comic_id>', methods=['DELETE'])
 def delete_comic(comic_id):
+    comic = database.get_comic(comic_id)
+    if comic:
+        PAGE_CACHE.invalidate(comic['file_path'])
+        optimizer.remove_optimized(comic)
+    covers.remove_cover(comic_id)
+    READERS_CACHE.pop(int(comic_id))
+    integrity.BROKEN.forget(int(comic_id))
+    PROGRESS.discard(comic_id)
     database.delete_comic(comic_id)
     return jsonify({'success': True})
 
@@ -130,13 +460,15 @@ def create_collection():
 
 @app.route('/api/collections/<int:collection_id>', methods=['GET'])
 def get_collection_items(collection_id):
+    PROGRESS.flush()
     items = database.get_collection_items(collection_id)
     return jsonify(items)
 
 @app.route('/api/collections/<int:collection_id>/add', methods=['POST'])
 def add_to_collection(collection_id):
     comic_id = request.json.get('comic_id')
-    database.add_to_collection(collection_id, comic_id)
+    if not database.add_to_collection(collection_id, comic_id):
+        return jsonify({'error': 'Not found'}), 404
     return jsonify({'success': True})
 
 @app.route('/api/collections/<int:collection_id>/rename', methods=['PUT'])
@@ -190,37 +522,380 @@ def update_marker_position(marker_id):
     database.update_marker_position(marker_id, data['x'], data['y'])
     return jsonify({'success': True})
 
+UPLOADS = uploads.UploadStore()
+
+def _upload_error(e):
+    return jsonify({'error': str(e), **e.details}), e.status
+
+def _add_uploaded_file(path):
+    """Adds one committed upload to the library and indexes just that comic"""
+    scanner.scan_directory(path)
+    comic_ids = database.get_comic_ids_by_paths([path])
+    if not comic_ids:
+        return None
+    indexer.index_comic(comic_ids[0])
+    return database.get_comic(comic_ids[0])
+
+def _upload_result(path, duplicate):
+    if duplicate is not None:
+        return jsonify({'success': True, 'added': 0, 'duplicate': True, 'comic': duplicate})
+    comic = _add_uploaded_file(path)
+    if comic is None:
+        return jsonify({'error': 'Upload could not be added'}), 500
+    return jsonify({'success': True, 'added': 1, 'duplicate': False, 'comic': comic})
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
+    """Single-request upload (multipart form field 'file'); large files should use /api/uploads"""
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
-    
-    if file:
-        filename = file.filename
-        # Ensure uploads directory exists
-        upload_folder = os.path.join(os.getcwd(), 'uploads')
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        save_path = os.path.join(upload_folder, filename)
-        print(f"Uploading file to: {save_path}")
-        file.save(save_path)
-        
-        # Scan the uploaded file
-        count = scanner.scan_directory(save_path)
-        return jsonify({'success': True, 'added': count})
+
+    try:
+        path, duplicate = UPLOADS.store(file.filename, file.stream)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return _upload_result(path, duplicate)
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Opens a chunked upload: {filename, size, sha256 (optional)}. A known sha256
+    of a file already in the library answers with that comic straight away."""
+    data = request.get_json(silent=True) or {}
+    try:
+        upload, duplicate = UPLOADS.create(data.get('filename'), data.get('size'), data.get('sha256'))
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    if duplicate is not None:
+        return _upload_result(None, duplicate)
+    return jsonify(upload.to_dict()), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Where to resume: the offset is the number of bytes stored so far"""
+    try:
+        return jsonify(UPLOADS.get(upload_id).to_dict())
+    except uploads.UploadError as e:
+        return _upload_error(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def append_upload(upload_id):
+    """Appends the raw request body at ?offset=, which must equal the stored offset"""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'No offset provided'}), 400
+    try:
+        return jsonify(UPLOADS.append(upload_id, offset, request.stream))
+    except uploads.UploadError as e:
+        return _upload_error(e)
+
+@app.route('/api/uploads/<upload_id>/commit', methods=['POST'])
+def commit_upload(upload_id):
+    try:
+        path, duplicate = UPLOADS.commit(upload_id)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    log.info("Upload %s added as %s", upload_id, path or f"duplicate of comic {duplicate['id']}")
+    return _upload_result(path, duplicate)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    try:
+        UPLOADS.abort(upload_id)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return jsonify({'success': True})
+
+# Optimized copies switch in as soon as they are written: drop the open reader
+OPTIMIZER = optimizer.OptimizeJob(on_done=READERS_CACHE.pop, book_cache=BOOK_CACHE)
+
+@app.route('/api/optimize', methods=['POST'])
+def optimize():
+    """Queues comic_ids, or every comic in collection_id, for an optimized copy.
+    Optional width (0 keeps the original size), format ('webp', 'jpeg') and quality."""
+    data = request.json or {}
+    comic_ids = [int(comic_id) for comic_id in data.get('comic_ids') or []]
+    if data.get('collection_id') is not None:
+        comic_ids += [c['id'] for c in database.get_collection_items(data['collection_id'])]
+    if not comic_ids:
+        return jsonify({'error': 'No comics selected'}), 400
+    fmt = data.get('format')
+    if fmt is not None and fmt not in ('webp', 'jpeg'):
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    width, quality = data.get('width'), data.get('quality')
+    if width is not None and (not isinstance(width, int) or width < 0):
+        return jsonify({'error': 'Invalid width'}), 400
+    if quality is not None and (not isinstance(quality, int) or not 1 <= quality <= 100):
+        return jsonify({'error': 'Invalid quality'}), 400
+    queued = OPTIMIZER.submit(comic_ids, fmt=fmt, width=width, quality=quality)
+    return jsonify({'queued': queued, **OPTIMIZER.status()}), 202
+
+@app.route('/api/optimize/status', methods=['GET'])
+def optimize_status():
+    return jsonify(OPTIMIZER.status())
+
+@app.route('/api/optimize/cancel', methods=['POST'])
+def optimize_cancel():
+    OPTIMIZER.cancel()
+    return jsonify(OPTIMIZER.status())
+
+@app.route('/api/comic/<int:comic_id>/optimized', methods=['DELETE'])
+def delete_optimized(comic_id):
+    """Goes back to reading the original file"""
+    comic = database.get_comic(comic_id)
+    if not comic:
+        return jsonify({'error': 'Comic not found'}), 404
+    optimizer.remove_optimized(comic)
+    READERS_CACHE.pop(comic_id)
+    return jsonify({'success': True})
+
+@app.route('/api/integrity/check', methods=['POST'])
+def integrity_check():
+    """Checks comic_ids, or every comic not checked since its file last changed"""
+    data = request.get_json(silent=True) or {}
+    comic_ids = data.get('comic_ids')
+    if comic_ids is None:
+        comic_ids = database.get_unchecked_comic_ids()
+    queued = integrity.CHECKER.submit([int(comic_id) for comic_id in comic_ids])
+    return jsonify({'queued': queued, **integrity.CHECKER.status()}), 202
+
+@app.route('/api/integrity/status', methods=['GET'])
+def integrity_status():
+    return jsonify(integrity.CHECKER.status())
+
+@app.route('/api/integrity/problems', methods=['GET'])
+def integrity_problems():
+    """Comics whose last check or open failed; stale ones changed since"""
+    problems = database.get_integrity_problems()
+    for problem in problems:
+        problem['stale'] = problem['integrity_mtime_ns'] != problem['mtime_ns']
+    return jsonify(problems)
+
+@app.route('/api/index/status', methods=['GET'])
+def index_status():
+    return jsonify(indexer.INDEXER.status())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'readers': READERS_CACHE.stats(),
+        'pages': PAGE_CACHE.stats(),
+        'renders': RENDER_CACHE.stats(),
+        'books': BOOK_CACHE.stats(),
+        'progress': PROGRESS.stats(),
+        'decode_pool': decodepool.POOL.stats() if decodepool.POOL else None,
+        'broken': integrity.BROKEN.stats(),
+    })
+
+def _cache_metrics():
+    caches = {
+        'readers': READERS_CACHE.stats(),
+        'pages': PAGE_CACHE.stats(),
+        'renders': RENDER_CACHE.stats(),
+        'books': BOOK_CACHE.stats(),
+    }
+    def samples(key):
+        return [({'cache': name}, stats[key]) for name, stats in caches.items()]
+    ratios = []
+    for name, stats in caches.items():
+        lookups = stats['hits'] + stats['misses']
+        ratios.append(({'cache': name}, round(stats['hits'] / lookups, 4) if lookups else 0.0))
+    progress = PROGRESS.stats()
+    index = indexer.INDEXER.status()
+    pool = decodepool.POOL.stats() if decodepool.POOL else {'workers': 0, 'calls': 0, 'errors': 0}
+    return [
+        ('kubrick_cache_hits_total', 'counter', 'Cache hits', samples('hits')),
+        ('kubrick_cache_misses_total', 'counter', 'Cache misses', samples('misses')),
+        ('kubrick_cache_evictions_total', 'counter', 'Cache evictions', samples('evictions')),
+        ('kubrick_cache_hit_ratio', 'gauge', 'Hits over lookups since start', ratios),
+        ('kubrick_cache_bytes', 'gauge', 'Bytes held (estimated for readers)', samples('bytes')),
+        ('kubrick_cache_max_bytes', 'gauge', 'Configured cache budget', samples('max_bytes')),
+        ('kubrick_page_prefetched_total', 'counter', 'Pages warmed by read-ahead',
+         [({}, caches['pages']['prefetched'])]),
+        ('kubrick_page_prefetch_hits_total', 'counter', 'Read-ahead pages that were then requested',
+         [({}, caches['pages']['prefetch_hits'])]),
+        ('kubrick_progress_updates_total', 'counter', 'Reading progress updates received',
+         [({}, progress['updates'])]),
+        ('kubrick_progress_commits_total', 'counter', 'Transactions used to store reading progress',
+         [({}, progress['commits'])]),
+        ('kubrick_index_queue', 'gauge', 'Comics indexed and queued in the current batch',
+         [({'state': 'done'}, index['done']), ({'state': 'total'}, index['total']),
+          ({'state': 'failed'}, index['failed'])]),
+        ('kubrick_decode_workers', 'gauge', 'Decode pool worker processes (0: in-process)',
+         [({}, pool['workers'])]),
+        ('kubrick_decode_calls_total', 'counter', 'Page operations run by decode workers, by result',
+         [({'result': 'ok'}, pool['calls']), ({'result': 'error'}, pool['errors'])]),
+    ]
+
+metrics.register_collector(_cache_metrics)
+# Slow requests are profiled into here when KUBRICK_PROFILE_SLOW_MS / --profile-slow-ms is set
+metrics.instrument(app, profile_dir=os.path.join(CACHE_DIR, 'profiles'))
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'ok'})
+    """Answers as soon as the server listens; ready turns true once the database
+    is open, until then other requests wait for it. 503 once startup failed,
+    so the shell reports the crash instead of opening a dead window."""
+    if _startup_error:
+        return jsonify({'status': 'error', 'ready': False, 'error': _startup_error, 'startup': STARTUP}), 503
+    ready = _startup_done is None or _startup_done.is_set()
+    return jsonify({'status': 'ok', 'ready': ready, 'startup': STARTUP})
+
+# Milliseconds from the start of main.py's imports to each startup phase
+STARTUP = {'imports_ms': None, 'listening_ms': None, 'ready_ms': None}
+# Set while startup work runs in the background; requests wait on it
+_startup_done = None
+_startup_error = None
+# Longest a request waits for the database to open
+STARTUP_WAIT_SECONDS = 60
+
+def _mark_startup(phase):
+    STARTUP[f'{phase}_ms'] = round((time.perf_counter() - _STARTED_AT) * 1000, 1)
+
+@app.before_request
+def _wait_for_startup():
+    done = _startup_done
+    if done is None or request.endpoint == 'health_check':
+        return None
+    if not done.wait(STARTUP_WAIT_SECONDS):
+        return jsonify({'error': 'Backend is starting'}), 503
+    if _startup_error:
+        return jsonify({'error': 'Backend startup failed', 'detail': _startup_error}), 503
+    return None
+
+def _startup(profile=False):
+    """Opens the database and starts background work, off the main thread so
+    the server listens (and /api/health answers) right away"""
+    global _startup_error
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        database.init_db()
+        _start_background_work()
+    except Exception as e:
+        _startup_error = f"{type(e).__name__}: {e}"
+        log.exception("Startup failed")
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _mark_startup('ready')
+        _startup_done.set()
+    if profile:
+        _report_startup(profiler)
+
+def _begin_startup(profile=False):
+    global _startup_done
+    _startup_done = threading.Event()
+    threading.Thread(target=_startup, args=(profile,), name='startup', daemon=True).start()
+
+def _report_startup(profiler):
+    """--startup-profile: phase times, which heavy modules got imported, and a
+    cProfile of the startup work in cache/profiles/startup.prof"""
+    import pstats
+    import sys
+    engines = {name: name in sys.modules for name in ('PIL', 'pypdfium2', 'rarfile', 'watchdog')}
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+    profile_dir = os.path.join(CACHE_DIR, 'profiles')
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, 'startup.prof')
+    profiler.dump_stats(path)
+    log.warning("Startup profile: %s, %d modules loaded, imported: %s, profile: %s\n%s",
+                json.dumps(STARTUP), len(sys.modules), json.dumps(engines), path, summary.getvalue(),
+                extra={'startup': STARTUP, 'modules': len(sys.modules), 'engines': engines})
+
+def _start_background_work():
+    if decodepool.POOL is not None:
+        threading.Thread(target=decodepool.POOL.start, name='decode-pool-start', daemon=True).start()
+    # Pick up anything a previous session did not finish indexing
+    indexer.INDEXER.submit(database.get_unindexed_comic_ids())
+    integrity.CHECKER.submit(database.get_unchecked_comic_ids(stale_only=True))
+    if WATCH_ENABLED:
+        roots = database.get_library_roots()
+        WATCHER.start(roots)
+        threading.Thread(target=_catch_up_roots, args=(roots,), daemon=True).start()
+
+# Set from --no-keep-alive; waitress closes the connection when the app says so
+KEEP_ALIVE = True
+
+@app.after_request
+def _connection_header(response):
+    if not KEEP_ALIVE:
+        response.headers['Connection'] = 'close'
+    return response
+
+def _parse_args(is_frozen):
+    import argparse
+    parser = argparse.ArgumentParser(description='KubrickHQ backend')
+    parser.add_argument('--server', choices=('waitress', 'dev'), default='waitress' if is_frozen else 'dev',
+                        help='waitress: multi-threaded production server; dev: Werkzeug development server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('KUBRICK_SERVER_THREADS', 16)),
+                        help='requests handled in parallel (waitress)')
+    parser.add_argument('--connection-limit', type=int, default=200,
+                        help='open connections accepted before new ones wait (waitress)')
+    parser.add_argument('--timeout', type=int, default=120,
+                        help='seconds a connection may stay idle, between keep-alive requests or '
+                             'mid-request from a stalled client, before it is closed (waitress)')
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false',
+                        help='close the connection after every response')
+    parser.add_argument('--log-level', default=logs.LOG_LEVEL,
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'OFF'), type=str.upper)
+    parser.add_argument('--log-format', default=logs.LOG_FORMAT, choices=('text', 'json'))
+    parser.add_argument('--decode-workers', type=int, default=decodepool.DECODE_WORKERS,
+                        help='processes for PDF rendering, resizing and thumbnails (0: in the server process)')
+    parser.add_argument('--startup-profile', action='store_true',
+                        default=os.environ.get('KUBRICK_STARTUP_PROFILE') == '1',
+                        help='log startup phase times and profile the startup work')
+    parser.add_argument('--profile-slow-ms', type=float, default=metrics.PROFILE_SLOW_MS,
+                        help='dump a cProfile of requests slower than this into cache/profiles (0: off)')
+    return parser.parse_args()
+
+def _serve_waitress(args):
+    from waitress import create_server
+    server = create_server(app, host=args.host, port=args.port, threads=args.threads,
+                           connection_limit=args.connection_limit, channel_timeout=args.timeout,
+                           ident='KubrickHQ')
+    _mark_startup('listening')
+    log.info("Listening on http://%s:%d after %.0f ms", args.host, args.port, STARTUP['listening_ms'])
+    server.run()
 
 if __name__ == '__main__':
-    database.init_db()
-    
+    _mark_startup('imports')
+    import multiprocessing
+    multiprocessing.freeze_support()
+
     import sys
     is_frozen = getattr(sys, 'frozen', False)
-    
-    print(f"Starting KubrickHQ Backend on port 5000... (Frozen: {is_frozen})")
-    app.run(host='127.0.0.1', port=5000, debug=not is_frozen, use_reloader=not is_frozen)
+    args = _parse_args(is_frozen)
+    KEEP_ALIVE = args.keep_alive
+    logs.configure(args.log_level, args.log_format)
+    metrics.PROFILE_SLOW_MS = args.profile_slow_ms
+    if decodepool.configure(args.decode_workers, args.log_level):
+        atexit.register(decodepool.POOL.shutdown)
+
+    # Exit normally on SIGTERM so atexit handlers (pending progress) run
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if args.server == 'waitress':
+        _begin_startup(args.startup_profile)
+        log.info("Starting KubrickHQ Backend (waitress, %d threads) on port %d... (Frozen: %s)",
+                 args.threads, args.port, is_frozen)
+        _serve_waitress(args)
+    else:
+        # With the reloader on, only the serving child should start background work
+        if is_frozen or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            _begin_startup(args.startup_profile)
+        log.info("Starting KubrickHQ Backend (dev server) on port %d... (Frozen: %s)", args.port, is_frozen)
+        app.run(host=args.host, port=args.port, debug=not is_frozen, use_reloader=not is_frozen, threaded=True)
@@ -0,0 +1,236 @@
+"""In-process metrics, served in the Prometheus text format by /api/metrics.
+
+Counters and histograms are updated on the hot paths (requests, page reads,
+SQLite statements, scans); collectors registered with register_collector()
+are read at scrape time (cache statistics and the like).
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+log = logging.getLogger(__name__)
+
+# Seconds; covers a cached page (sub-millisecond) up to a big solid CBR
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+_collectors = []
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._sample_lines(key, value))
+        return lines
+
+    def _sample_lines(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (made cumulative when rendered), sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _sample_lines(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+        lines.append(f'{self.name}_bucket{labels} {count}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+def register_collector(collect):
+    """collect() is called on every scrape and returns (name, type, help, samples)
+    tuples, samples being (labels dict, value) pairs"""
+    _collectors.append(collect)
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        try:
+            families = list(collect())
+        except Exception:
+            log.exception('Metrics collector failed')
+            continue
+        for name, metric_type, documentation, samples in families:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+# --- Metrics shared across modules ---
+HTTP_REQUEST_SECONDS = Histogram(
+    'kubrick_http_request_duration_seconds',
+    'Time to build the response, by route, method and status', ('route', 'method', 'status'))
+HTTP_RESPONSE_BYTES = Counter(
+    'kubrick_http_response_bytes_total', 'Response body bytes with a known length, by route', ('route',))
+PAGE_SECONDS = Histogram(
+    'kubrick_page_seconds',
+    'Time to produce page bytes on a cache miss, by source format (cbz, cbr, pdf) and operation '
+    '(extract, extract_book, render, resize, or pool for work done by decode workers)', ('format', 'operation'))
+SQLITE_SECONDS = Histogram(
+    'kubrick_sqlite_statement_seconds',
+    'SQLite statement execution (prepare and first step) and commit time, by statement kind', ('statement',))
+SCAN_FILES = Counter(
+    'kubrick_scan_files_total', 'Files seen by scans and file watching, by result', ('result',))
+SCAN_SECONDS = Histogram(
+    'kubrick_scan_duration_seconds', 'Duration of folder scans', buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 1800))
+SCAN_FILES_PER_SECOND = Gauge(
+    'kubrick_scan_last_files_per_second', 'Throughput of the most recent folder scan')
+INDEX_SECONDS = Histogram(
+    'kubrick_index_comic_seconds', 'Time to index one comic (manifest and cover)')
+INTEGRITY_CHECKS = Counter(
+    'kubrick_integrity_checks_total',
+    'Comics checked by the integrity job, by result (ok, damaged, corrupt, unreadable)', ('result',))
+
+# --- Flask integration ---
+# Requests slower than this are profiled with cProfile; 0 turns profiling off
+PROFILE_SLOW_MS = float(os.environ.get('KUBRICK_PROFILE_SLOW_MS', 0))
+# Newest profile dumps kept
+PROFILE_KEEP = 50
+
+# cProfile hooks one thread at a time on recent Pythons, so at most one
+# request is profiled at once; concurrent ones run unprofiled
+_profile_lock = threading.Lock()
+
+def instrument(app, profile_dir=None):
+    """Times every request of app into HTTP_REQUEST_SECONDS/HTTP_RESPONSE_BYTES.
+    With PROFILE_SLOW_MS > 0, requests slower than that are dumped as .prof
+    files into profile_dir and summarized in the log."""
+
+    @app.before_request
+    def _start_request():
+        g.metrics_start = time.perf_counter()
+        if PROFILE_SLOW_MS > 0 and _profile_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def _finish_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=response.status_code)
+        if response.content_length is not None and response.status_code != 304:
+            HTTP_RESPONSE_BYTES.inc(response.content_length, route=route)
+        profiler = _stop_profiler()
+        if profiler is not None and elapsed * 1000 >= PROFILE_SLOW_MS:
+            _dump_profile(profiler, profile_dir, route, elapsed)
+        return response
+
+    @app.teardown_request
+    def _teardown_request(exc):
+        # after_request is skipped when the view raised
+        _stop_profiler()
+
+def _stop_profiler():
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+    return profiler
+
+def _dump_profile(profiler, profile_dir, route, elapsed):
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+    path = None
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        path = os.path.join(profile_dir, f'{int(time.time() * 1000)}_{slug}.prof')
+        profiler.dump_stats(path)
+        dumps = sorted(f for f in os.listdir(profile_dir) if f.endswith('.prof'))
+        for name in dumps[:-PROFILE_KEEP]:
+            try:
+                os.remove(os.path.join(profile_dir, name))
+            except OSError:
+                pass
+    log.warning('Slow request %s %s took %.0f ms, profile: %s\n%s',
+                request.method, request.path, elapsed * 1000, path, summary.getvalue())
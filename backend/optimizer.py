@@ -0,0 +1,242 @@
+"""Opt-in "optimize" job: repacks CBR and PDF books into fast-access CBZs.
+
+Every page is encoded once (WebP or JPEG, scaled to fit a maximum width) and
+stored uncompressed in a CBZ under cache/optimized, so reading the book later
+needs neither unrar nor pdfium and its pages stream straight from the file.
+The original stays where it is and remains comics.file_path; the copy is
+recorded in comics.optimized_path together with the original's mtime, and
+readers use it only while that still matches. Copies count against a disk
+budget.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+
+import database
+from cache import CACHE_DIR
+from reader import ComicReader
+
+log = logging.getLogger(__name__)
+
+OPTIMIZED_DIR = os.path.join(CACHE_DIR, 'optimized')
+# Disk space all optimized copies may take together
+OPTIMIZE_MAX_BYTES = int(os.environ.get('KUBRICK_OPTIMIZE_MAX_MB', 4096)) * 1024 * 1024
+# Page encoding used unless a job asks otherwise
+OPTIMIZE_FORMAT = os.environ.get('KUBRICK_OPTIMIZE_FORMAT', 'webp')
+OPTIMIZE_WIDTH = int(os.environ.get('KUBRICK_OPTIMIZE_WIDTH', 1600))
+OPTIMIZE_QUALITY = int(os.environ.get('KUBRICK_OPTIMIZE_QUALITY', 85))
+# Formats worth converting; CBZs already read without external tools
+OPTIMIZABLE_FORMATS = ('cbr', 'rar', 'pdf')
+
+_EXTENSIONS = {'webp': '.webp', 'jpeg': '.jpg', 'png': '.png'}
+
+def optimized_path_for(comic):
+    """The copy a reader should open instead of comic['file_path'], or None
+    when there is none or the original changed since it was made"""
+    path = comic.get('optimized_path')
+    if not path:
+        return None
+    try:
+        if os.stat(comic['file_path']).st_mtime_ns != comic['optimized_mtime_ns']:
+            return None
+    except OSError:
+        return None
+    return path if os.path.exists(path) else None
+
+def disk_usage():
+    """Bytes taken by finished copies; a copy still being written (.tmp) is not counted"""
+    try:
+        with os.scandir(OPTIMIZED_DIR) as it:
+            return sum(entry.stat().st_size for entry in it
+                       if entry.is_file() and not entry.name.endswith('.tmp'))
+    except FileNotFoundError:
+        return 0
+
+def remove_optimized(comic):
+    """Deletes a comic's optimized copy and forgets it"""
+    path = comic.get('optimized_path')
+    database.clear_optimized(comic['id'])
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def prune():
+    """Deletes copies no comic points at (deleted comics, replaced originals)"""
+    try:
+        names = os.listdir(OPTIMIZED_DIR)
+    except FileNotFoundError:
+        return 0
+    keep = {os.path.basename(path) for path in database.get_optimized_paths()}
+    removed = 0
+    for name in names:
+        if name not in keep:
+            try:
+                os.remove(os.path.join(OPTIMIZED_DIR, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+class OptimizeJob:
+    """Background queue converting one comic at a time, with progress for
+    /api/optimize/status. on_done(comic_id) runs after each successful copy.
+    book_cache: the shared cache.BookCache, so solid CBRs are extracted once
+    rather than by one unrar run per page."""
+
+    def __init__(self, on_done=None, book_cache=None):
+        self.on_done = on_done
+        self.book_cache = book_cache
+        self._queue = deque()  # (comic_id, options)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cancel = threading.Event()
+        self._current = None
+        self._reset_counts()
+
+    def _reset_counts(self):
+        self.total = 0
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.errors = []  # last few (comic_id, reason)
+
+    def submit(self, comic_ids, fmt=None, width=None, quality=None):
+        options = {
+            'fmt': fmt or OPTIMIZE_FORMAT,
+            'width': OPTIMIZE_WIDTH if width is None else width,
+            'quality': quality or OPTIMIZE_QUALITY,
+        }
+        with self._lock:
+            if self._thread is None:
+                self._reset_counts()
+            queued = {comic_id for comic_id, _ in self._queue}
+            if self._current:
+                queued.add(self._current['comic_id'])
+            new = [comic_id for comic_id in dict.fromkeys(comic_ids) if comic_id not in queued]
+            self._queue.extend((comic_id, options) for comic_id in new)
+            self.total += len(new)
+            if self._thread is None and self._queue:
+                self._thread = threading.Thread(target=self._run, name='optimizer', daemon=True)
+                self._thread.start()
+        return len(new)
+
+    def cancel(self):
+        """Drops queued comics and stops the current one at its next page"""
+        with self._lock:
+            self.total -= len(self._queue)
+            self._queue.clear()
+        self._cancel.set()
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self._thread is not None,
+                'total': self.total,
+                'done': self.done,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'queued': len(self._queue),
+                'current': dict(self._current) if self._current else None,
+                'bytes_before': self.bytes_before,
+                'bytes_after': self.bytes_after,
+                'disk_usage': disk_usage(),
+                'disk_budget': OPTIMIZE_MAX_BYTES,
+                'errors': list(self.errors),
+            }
+
+    def _run(self):
+        prune()
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._thread = None
+                    self._current = None
+                    return
+                comic_id, options = self._queue.popleft()
+                # A cancel only reaches comics queued before it
+                self._cancel.clear()
+                self._current = {'comic_id': comic_id, 'page': 0, 'page_count': None}
+            try:
+                result = self._optimize(comic_id, **options)
+            except Exception as e:
+                log.exception("Optimizing comic %s failed", comic_id)
+                result = f"{type(e).__name__}: {e}"
+            with self._lock:
+                if result is True:
+                    self.done += 1
+                elif result is None:
+                    self.skipped += 1
+                else:
+                    self.failed += 1
+                    self.errors = (self.errors + [{'comic_id': comic_id, 'error': result}])[-20:]
+            if result is True and self.on_done is not None:
+                self.on_done(comic_id)
+
+    def _progress(self, page, page_count):
+        with self._lock:
+            if self._current is not None:
+                self._current.update(page=page, page_count=page_count)
+
+    def _optimize(self, comic_id, fmt, width, quality):
+        """True when a copy was made, None when the comic does not need one,
+        otherwise the reason it failed"""
+        comic = database.get_comic(comic_id)
+        if not comic or comic['format'] not in OPTIMIZABLE_FORMATS or optimized_path_for(comic):
+            return None
+        if disk_usage() >= OPTIMIZE_MAX_BYTES:
+            return 'Disk budget for optimized copies is used up'
+
+        source = comic['file_path']
+        mtime_ns = os.stat(source).st_mtime_ns
+        start = time.perf_counter()
+        os.makedirs(OPTIMIZED_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=OPTIMIZED_DIR, suffix='.tmp')
+        os.close(fd)
+        reader = ComicReader(source, book_cache=self.book_cache)
+        try:
+            page_count = reader.get_page_count()
+            if page_count == 0:
+                return 'No readable pages'
+            # Stored, not deflated: the pages are compressed images already
+            with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED) as zf:
+                for index in range(page_count):
+                    if self._cancel.is_set():
+                        return 'Cancelled'
+                    self._progress(index, page_count)
+                    # Never upscales; PDFs render straight at the target width
+                    data = reader.get_page_data(index, width=width or None, fmt=fmt, quality=quality)
+                    if data is None:
+                        return f'Page {index} could not be read'
+                    zf.writestr(f'{index:05d}{_EXTENSIONS[fmt]}', data)
+            size = os.path.getsize(tmp_path)
+            if disk_usage() + size > OPTIMIZE_MAX_BYTES:
+                return 'Copy would exceed the disk budget for optimized copies'
+
+            path = os.path.join(OPTIMIZED_DIR, f"{comic_id}_{mtime_ns}.cbz")
+            os.replace(tmp_path, path)
+            old_path = comic.get('optimized_path')
+            database.set_optimized(comic_id, path, mtime_ns)
+            if old_path and old_path != path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+            original_size = os.path.getsize(source)
+            with self._lock:
+                self.bytes_before += original_size
+                self.bytes_after += size
+            log.info("Optimized %s: %d pages, %d -> %d bytes in %.1fs",
+                     source, page_count, original_size, size, time.perf_counter() - start)
+            return True
+        finally:
+            reader.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -1,22 +1,37 @@
+import functools
+import hashlib
+import io
+import json
+import logging
 import os
+import platform
+import struct
+import sys
 import zipfile
-import rarfile
-import pypdfium2 as pdfium
-import png
-from io import BytesIO
 import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import decodepool
+import images
+import metrics
+from cache import CACHE_DIR
+
+log = logging.getLogger(__name__)
 
 # Simple natural sort key
 def natural_keys(text):
     return [int(c) if c.isdigit() else c.lower() for c in re.split(r'(\d+)', text)]
 
-# Configure RarMap
-import platform
-if platform.system() == 'Windows':
-    # Check common paths for UnRAR
+# Where UnRAR was found last time, so later starts skip probing for it
+TOOLS_CACHE = os.path.join(CACHE_DIR, 'tools.json')
+
+def _unrar_candidates():
     base_dir = os.path.dirname(os.path.abspath(__file__))
     cwd = os.getcwd()
-    possible_paths = [
+    return [
         os.path.join(base_dir, 'UnRAR.exe'),
         os.path.join(base_dir, 'unrar.exe'),
         os.path.join(base_dir, '..', 'UnRAR.exe'), # Project root relative to file
@@ -26,52 +41,262 @@ if platform.system() == 'Windows':
         r"C:\Program Files\WinRAR\UnRAR.exe",
         r"C:\Program Files (x86)\WinRAR\UnRAR.exe"
     ]
-    
-    print("--- UnRAR Detection Debug ---")
-    found = False
-    for p in possible_paths:
+
+def _find_unrar():
+    """Path of UnRAR.exe on Windows (elsewhere rarfile finds unrar on PATH), None if missing"""
+    try:
+        with open(TOOLS_CACHE, encoding='utf-8') as f:
+            cached = json.load(f)['unrar']
+        if os.path.exists(cached):
+            return cached
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    for p in _unrar_candidates():
         exists = os.path.exists(p)
-        print(f"Checking: {p} -> {exists}")
+        log.debug("UnRAR detection: %s -> %s", p, exists)
         if exists:
-            rarfile.UNRAR_TOOL = p
-            print(f"SUCCESS: UnRAR tool configured at {p}")
-            found = True
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(TOOLS_CACHE, 'w', encoding='utf-8') as f:
+                    json.dump({'unrar': p}, f)
+            except OSError as e:
+                log.warning("Could not remember the UnRAR location: %s", e)
+            return p
+    return None
+
+# Format engines are imported on first use, keeping them off the startup path
+@functools.lru_cache(maxsize=None)
+def _rarfile():
+    import rarfile
+    if platform.system() == 'Windows':
+        tool = _find_unrar()
+        if tool:
+            rarfile.UNRAR_TOOL = tool
+            log.info("UnRAR tool configured at %s", tool)
+        else:
+            log.warning("UnRAR.exe not found in any common location. CBR files will fail.")
+    return rarfile
+
+@functools.lru_cache(maxsize=None)
+def _pdfium():
+    import pypdfium2 as pdfium
+    return pdfium
+
+# pdfium is not thread-safe, not even across separate documents
+PDFIUM_LOCK = threading.Lock()
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# PDF rendering: default resolution when the client gives no target size.
+# Requested sizes are rounded up to SIZE_STEP so nearby viewports share cache entries
+PDF_RENDER_DPI = int(os.environ.get('KUBRICK_PDF_DPI', 144))
+PDF_FORMAT = os.environ.get('KUBRICK_PDF_FORMAT', 'jpeg')
+PDF_QUALITY = int(os.environ.get('KUBRICK_PDF_QUALITY', 85))
+PDF_MAX_WIDTH = 4096
+SIZE_STEP = 64
+# Quality for resized archive pages
+VARIANT_QUALITY = 85
+
+def _round_size(value):
+    if not value:
+        return None
+    return min(-(-int(value) // SIZE_STEP) * SIZE_STEP, PDF_MAX_WIDTH)
+
+# Shared background pool that warms upcoming pages for readers in read-ahead mode
+PREFETCH_WORKERS = int(os.environ.get('KUBRICK_PREFETCH_WORKERS', 2))
+_prefetch_executor = None
+_prefetch_executor_lock = threading.Lock()
+
+def _get_prefetch_executor():
+    global _prefetch_executor
+    with _prefetch_executor_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
+        return _prefetch_executor
+
+# Fixed part of a zip local file header: signature ... file name length, extra field length
+_LOCAL_HEADER = struct.Struct('<4s22xHH')
+
+class FileSlice(io.RawIOBase):
+    """Read-only view of length bytes of a file starting at offset, so a stored
+    archive entry can be streamed (and range-served) straight from the archive"""
+
+    def __init__(self, path, offset, length):
+        self._file = open(path, 'rb')
+        self._offset = offset
+        self._length = length
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._length
+        self._pos = max(0, min(pos, self._length))
+        return self._pos
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self._length - self._pos)
+        if count <= 0:
+            return 0
+        self._file.seek(self._offset + self._pos)
+        count = self._file.readinto(memoryview(buffer)[:count])
+        self._pos += count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+# Bytes of each page read at index time to get its format and pixel size
+MANIFEST_PROBE_BYTES = 64 * 1024
+
+def _format_for_name(name):
+    ext = os.path.splitext(name)[1].lower().lstrip('.')
+    return 'jpeg' if ext == 'jpg' else ext
+
+def _book_page_name(index, entry_name):
+    # Flat, index-based names: entry names may nest or hold characters the filesystem rejects
+    return f"{index:05d}{os.path.splitext(entry_name)[1].lower()}"
+
+def _read_exact(stream, size):
+    chunks = []
+    while size > 0:
+        chunk = stream.read(min(size, 1024 * 1024))
+        if not chunk:
             break
-    
-    if not found:
-        print("FAILURE: UnRAR.exe not found in any common location. CBR files will fail.")
-    print("-----------------------------")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def _skip_exact(stream, size):
+    while size > 0:
+        chunk = stream.read(min(size, 1024 * 1024))
+        if not chunk:
+            raise _rarfile().BadRarFile("Unexpected end of data")
+        size -= len(chunk)
+
+def _problem(e):
+    """(status, message) for an error opening or checking a comic: 'unreadable'
+    when the file or a tool it needs is unavailable, 'corrupt' otherwise"""
+    unavailable = isinstance(e, OSError) or (
+        'rarfile' in sys.modules and isinstance(e, _rarfile().RarCannotExec))
+    return ('unreadable' if unavailable else 'corrupt'), f"{type(e).__name__}: {e}"
 
 class ComicReader:
-    def __init__(self, file_path):
+    def __init__(self, file_path, page_cache=None, read_ahead=0, render_cache=None, book_cache=None,
+                 manifest=None):
+        """page_cache: optional cache.PageCache shared between readers.
+        read_ahead: when > 0 (and a page_cache is given), serving page N warms
+        pages N+1..N+read_ahead and N-1 in the background.
+        render_cache: optional cache.DiskCache for rendered PDF pages and
+        resized page variants.
+        book_cache: optional cache.BookCache; solid CBRs are extracted into it
+        in one pass instead of running unrar for every page.
+        manifest: optional (mtime_ns, pages) as stored by database.set_pages. While
+        it matches the file's mtime the reader opens without listing the archive.
+        """
         self.file_path = file_path
+        self.page_cache = page_cache
+        self.render_cache = render_cache
+        self.book_cache = book_cache
+        self.read_ahead = read_ahead if page_cache is not None else 0
         self.ext = os.path.splitext(file_path)[1].lower()
         self.type = self._determine_type()
         self._page_names = [] # For Archives
         self._doc = None # For PDF
+        self._pdf_page_count = 0
+        self._archive = None # Open ZipFile/RarFile, kept for the reader's lifetime
+        self._lock = threading.RLock()
+        self._closed = False
+        self._prefetching = set()
+        self._prefetch_lock = threading.Lock()
+        self._spans = {} # page index -> (offset, length) of stored zip entries, None if compressed
+        # Solid RAR: every entry is compressed as part of one stream. None until the
+        # archive is opened, which a reader loaded from a manifest has not done
+        self._solid = None if self.type == 'cbr' else False
+        self._extract_failed = False
+        self.has_manifest = False
+        self.error = None # (status, message) when the file could not be opened, see _problem
         
+        try:
+            self._mtime_ns = os.stat(file_path).st_mtime_ns
+        except OSError:
+            self._mtime_ns = 0
+
+        if manifest is not None and manifest[1] and manifest[0] == self._mtime_ns:
+            self._load_manifest(manifest[1])
+            return
+
         try:
             if self.type == 'pdf':
-                self._doc = pdfium.PdfDocument(self.file_path)
-            elif self.type in ['cbz', 'zip']:
-                with zipfile.ZipFile(self.file_path, 'r') as zf:
-                    all_files = zf.namelist()
-                    self._page_names = sorted(
-                        [f for f in all_files if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))],
-                        key=natural_keys
-                    )
-            elif self.type in ['cbr', 'rar']:
+                doc = self._open_document()
+                with PDFIUM_LOCK:
+                    self._pdf_page_count = len(doc)
+            elif self.type in ['cbz', 'cbr']:
                 # rarfile requires unrar installed
-                with rarfile.RarFile(self.file_path, 'r') as rf:
-                    all_files = rf.namelist()
-                    self._page_names = sorted(
-                        [f for f in all_files if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))],
-                        key=natural_keys
-                    )
+                archive = self._open_archive()
+                self._page_names = sorted(
+                    [f for f in archive.namelist() if f.lower().endswith(IMAGE_EXTS)],
+                    key=natural_keys
+                )
         except Exception as e:
-            print(f"Error initializing reader for {file_path}: {e}")
+            log.error("Error initializing reader for %s: %s", file_path, e)
             # We don't raise here to allow the object to exist, but it will be empty
-            pass
+            self.error = _problem(e)
+
+    @property
+    def mtime_ns(self):
+        """mtime of the file when the reader opened it"""
+        return self._mtime_ns
+
+    def verify(self):
+        """Reads the whole file and checks its structure: the CRC of every
+        archive entry, or that every PDF page loads. Returns None when the
+        comic is fine, self.error when it did not open, otherwise ('damaged',
+        message): it opens, but some pages may not read."""
+        if self.error:
+            return self.error
+        try:
+            if self.type == 'pdf':
+                doc = self._open_document()
+                bad = []
+                for index in range(self._pdf_page_count):
+                    try:
+                        with PDFIUM_LOCK:
+                            doc[index].close()
+                    except Exception as e:
+                        bad.append((index, e))
+                if bad:
+                    index, e = bad[0]
+                    return 'damaged', (f"{len(bad)} of {self._pdf_page_count} pages do not load, "
+                                       f"first page {index + 1}: {type(e).__name__}: {e}")
+            elif self.type == 'cbz':
+                with self._lock:
+                    bad = self._open_archive().testzip()
+                if bad is not None:
+                    return 'damaged', f"Bad CRC or header for {bad}"
+            elif self.type == 'cbr':
+                # Runs unrar over every entry
+                with self._lock:
+                    self._open_archive().testrar()
+            else:
+                return 'unreadable', f"Unsupported file type {self.ext}"
+        except Exception as e:
+            return 'damaged', f"{type(e).__name__}: {e}"
+        if self.get_page_count() == 0:
+            return 'damaged', 'No pages'
+        return None
 
     def _determine_type(self):
         if self.ext in ['.pdf']: return 'pdf'
@@ -79,39 +304,447 @@ class ComicReader:
         if self.ext in ['.cbr', '.rar']: return 'cbr'
         return 'unknown'
 
+    def _open_archive(self):
+        """Returns the open archive handle, reopening it if the reader was closed"""
+        with self._lock:
+            if self._archive is None:
+                if self.type == 'cbz':
+                    self._archive = zipfile.ZipFile(self.file_path, 'r')
+                elif self.type == 'cbr':
+                    self._archive = _rarfile().RarFile(self.file_path, 'r')
+                    # The first entry of a solid archive starts the stream and has no flag
+                    self._solid = any(info.flags & _rarfile().RAR_FILE_SOLID for info in self._archive.infolist())
+            return self._archive
+
+    def _is_solid(self):
+        if self._solid is None:
+            self._open_archive()
+        return self._solid
+
+    def _load_manifest(self, pages):
+        if self.type == 'pdf':
+            self._pdf_page_count = len(pages)
+        elif self.type in ['cbz', 'cbr']:
+            self._page_names = [page['entry_name'] for page in pages]
+            if self.type == 'cbz':
+                self._spans = {
+                    i: (page['data_offset'], page['compress_size']) if page['data_offset'] is not None else None
+                    for i, page in enumerate(pages)
+                }
+        self.has_manifest = True
+
+    def build_manifest(self):
+        """(mtime_ns, pages) for database.set_pages: one dict per page in reading
+        order with its archive entry, sizes, offsets, format and pixel size"""
+        pages = []
+        if self.type == 'pdf':
+            doc = self._open_document()
+            # Pixel size of the default render
+            scale = PDF_RENDER_DPI / 72
+            with PDFIUM_LOCK:
+                sizes = [doc.get_page_size(i) for i in range(self._pdf_page_count)]
+            for width, height in sizes:
+                pages.append({
+                    'format': 'pdf',
+                    'width': round(width * scale),
+                    'height': round(height * scale),
+                    'is_spread': width > height,
+                })
+            return self._mtime_ns, pages
+
+        with self._lock:
+            archive = self._open_archive()
+            for index, name in enumerate(self._page_names):
+                info = archive.getinfo(name)
+                page = {
+                    'entry_name': name,
+                    'compress_type': info.compress_type,
+                    'compress_size': info.compress_size,
+                    'file_size': info.file_size,
+                    'format': _format_for_name(name),
+                }
+                if self.type == 'cbz':
+                    page['header_offset'] = info.header_offset
+                    span = self.get_stored_span(index)
+                    page['data_offset'] = span[0] if span else None
+                probed = self._probe_page(archive, info)
+                if probed:
+                    page['format'], page['width'], page['height'] = probed
+                    page['is_spread'] = page['width'] > page['height']
+                pages.append(page)
+        return self._mtime_ns, pages
+
+    def _probe_page(self, archive, info):
+        """(format, width, height) of an archive page from the start of its data.
+        RAR entries are only probed when stored, since reading a compressed one
+        means running unrar."""
+        if self.type == 'cbr' and (self._solid or info.compress_type != _rarfile().RAR_M0):
+            return None
+        try:
+            with archive.open(info) as f:
+                head = f.read(MANIFEST_PROBE_BYTES)
+                probed = images.probe(head)
+                if probed is None and len(head) == MANIFEST_PROBE_BYTES:
+                    # Header extends past the probe (e.g. a large EXIF block)
+                    probed = images.probe(head + f.read())
+            return probed
+        except Exception as e:
+            log.warning("Error probing %s in %s: %s - %s", info.filename, self.file_path, type(e).__name__, e)
+            return None
+
+    def _open_document(self):
+        """Returns the open PdfDocument, reopening it if the reader was closed"""
+        with self._lock:
+            if self._doc is None:
+                with PDFIUM_LOCK:
+                    self._doc = _pdfium().PdfDocument(self.file_path)
+            return self._doc
+
     def get_page_count(self):
-        if self.type == 'pdf' and self._doc:
-            return len(self._doc)
+        if self.type == 'pdf':
+            return self._pdf_page_count
         return len(self._page_names)
 
-    def get_page_data(self, index):
-        """Returns bytes of the image at index (0-based)"""
+    def estimated_memory(self):
+        """Rough resident size of the reader, used to bound the reader cache"""
+        if self.type == 'pdf':
+            return 2 * 1024 * 1024 + 16 * 1024 * self._pdf_page_count
+        return 64 * 1024 + 512 * len(self._page_names)
+
+    def get_page_mimetype(self, index, fmt=None):
+        """Content type of what get_page_data returns for the same arguments"""
+        if self.type == 'pdf':
+            return images.mimetype_for_format(fmt or PDF_FORMAT)
+        if fmt:
+            return images.mimetype_for_format(fmt)
+        if 0 <= index < len(self._page_names):
+            return images.mimetype_for_name(self._page_names[index])
+        return 'application/octet-stream'
+
+    def _variant(self, width, height, fmt, quality):
+        """Normalized rendering options, None for an archive page served as stored"""
+        if self.type == 'pdf':
+            width, height = _round_size(width), _round_size(height)
+            return (width, height, fmt or PDF_FORMAT, quality or PDF_QUALITY)
+        if not (width or height or fmt):
+            return None
+        return (width, height, fmt, quality or VARIANT_QUALITY)
+
+    def get_page_data(self, index, width=None, height=None, fmt=None, quality=None):
+        """Returns bytes of the image at index (0-based).
+
+        width/height (pixels) give a box the page is scaled to fit in, fmt
+        ('jpeg', 'webp', 'png') and quality select the encoding. Without them
+        archive pages are returned as stored and PDFs rendered at PDF_RENDER_DPI.
+        """
+        variant = self._variant(width, height, fmt, quality)
+        data = self._cached_page(index, variant)
+        if self.read_ahead:
+            self._schedule_read_ahead(index, variant)
+        return data
+
+    def _cached_page(self, index, variant):
+        if self.page_cache is None:
+            return self._read_page(index, variant)
+
+        key = (self.file_path, index, variant)
+        data = self.page_cache.get(key)
+        if data is None:
+            data = self._read_page(index, variant)
+            if data is not None:
+                self.page_cache.put(key, data)
+        return data
+
+    def iter_pages(self, start, count, width=None, height=None, fmt=None, quality=None):
+        """Yields (index, bytes or None) for up to count pages from start, in order,
+        taking the same options as get_page_data.
+
+        Stored CBZ pages are read front to back through one file handle; other
+        pages come from the page cache or are read as get_page_data would, with
+        one read-ahead past the end of the run instead of one per page.
+        """
+        variant = self._variant(width, height, fmt, quality)
+        start = max(start, 0)
+        end = min(start + count, self.get_page_count())
+        f = None
         try:
-            if self.type == 'pdf' and self._doc:
-                if 0 <= index < len(self._doc):
-                    page = self._doc[index]
-                    bitmap = page.render(scale=2, rev_byteorder=True)
-                    buf = BytesIO()
-                    png.from_array(bitmap.buffer, mode='RGBA', width=bitmap.width, height=bitmap.height).save(buf)
-                    return buf.getvalue()
-            
-            elif self.type == 'cbz':
-                if 0 <= index < len(self._page_names):
-                    with zipfile.ZipFile(self.file_path, 'r') as zf:
-                        return zf.read(self._page_names[index])
+            for index in range(start, end):
+                span = self.get_stored_span(index) if variant is None else None
+                if span is None:
+                    yield index, self._cached_page(index, variant)
+                    continue
+                if f is None:
+                    f = open(self.file_path, 'rb')
+                f.seek(span[0])
+                data = f.read(span[1])
+                yield index, data if len(data) == span[1] else None
+        finally:
+            if f is not None:
+                f.close()
+        # Stored pages are cheaper to read again than to hold in memory
+        if self.read_ahead and start < end < self.get_page_count() \
+                and (variant is not None or self.get_stored_span(end) is None):
+            self._schedule_read_ahead(end - 1, variant)
 
-            elif self.type == 'cbr':
+    def page_etag(self, index, width=None, height=None, fmt=None, quality=None):
+        """Strong validator for what get_page_data returns for the same arguments,
+        derived from the file, its mtime, the entry and the rendering options"""
+        entry = self._page_names[index] if 0 <= index < len(self._page_names) else index
+        variant = self._variant(width, height, fmt, quality)
+        source = f"{self.file_path}\0{self._mtime_ns}\0{entry}\0{variant}"
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def get_stored_span(self, index):
+        """(offset, length) of the page's bytes in the archive file when the entry
+        is stored uncompressed (as most CBZ pages are), otherwise None"""
+        if self.type != 'cbz' or not 0 <= index < len(self._page_names):
+            return None
+        if index in self._spans:
+            return self._spans[index]
+        span = None
+        try:
+            with self._lock:
+                info = self._open_archive().getinfo(self._page_names[index])
+            # Bit 0: encrypted
+            if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                # The data starts after the local header, whose extra field may
+                # differ from the central directory's
+                with open(self.file_path, 'rb') as f:
+                    f.seek(info.header_offset)
+                    header = f.read(_LOCAL_HEADER.size)
+                if len(header) == _LOCAL_HEADER.size:
+                    signature, name_length, extra_length = _LOCAL_HEADER.unpack(header)
+                    if signature == b'PK\x03\x04':
+                        offset = info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+                        span = (offset, info.compress_size)
+        except Exception as e:
+            log.warning("Error locating page %d of %s: %s - %s", index, self.file_path, type(e).__name__, e)
+        self._spans[index] = span
+        return span
+
+    def _schedule_read_ahead(self, index, variant):
+        count = self.get_page_count()
+        wanted = list(range(index + 1, index + 1 + self.read_ahead)) + [index - 1]
+        with self._prefetch_lock:
+            targets = [
+                i for i in wanted
+                if 0 <= i < count and (i, variant) not in self._prefetching
+                and (self.file_path, i, variant) not in self.page_cache
+            ]
+            self._prefetching.update((i, variant) for i in targets)
+        if targets:
+            # One task per batch so archives are read front to back by one worker
+            _get_prefetch_executor().submit(self._prefetch, targets, variant)
+
+    def _prefetch(self, indexes, variant):
+        for i in indexes:
+            try:
+                key = (self.file_path, i, variant)
+                # An evicted reader must not reopen its archive just to prefetch
+                if not self._closed and key not in self.page_cache:
+                    data = self._read_page(i, variant)
+                    if data is not None:
+                        self.page_cache.put(key, data, prefetched=True)
+            finally:
+                with self._prefetch_lock:
+                    self._prefetching.discard((i, variant))
+
+    def _render_pdf_page(self, index, width, height, fmt, quality):
+        doc = self._open_document()
+        with PDFIUM_LOCK:
+            page = doc[index]
+            scales = []
+            if width:
+                scales.append(width / page.get_width())
+            if height:
+                scales.append(height / page.get_height())
+            scale = min(scales) if scales else PDF_RENDER_DPI / 72
+        scale = round(scale, 4)
+
+        key = (self.file_path, self._mtime_ns, index, scale, fmt, quality)
+        if self.render_cache is not None:
+            data = self.render_cache.get(key)
+            if data is not None:
+                return data
+
+        if self._offload():
+            data = self._offloaded('_render_pdf_page', index, width, height, fmt, quality)
+        else:
+            with metrics.PAGE_SECONDS.time(format='pdf', operation='render'):
+                with PDFIUM_LOCK:
+                    image = page.render(scale=scale).to_pil()
+                # Encoding runs outside the lock, Pillow releases the GIL
+                data = images.encode(image, fmt, quality)
+        if self.render_cache is not None:
+            self.render_cache.put(key, data)
+        return data
+
+    def _offload(self):
+        """Whether CPU-heavy page work goes to the decode pool. Solid CBRs stay:
+        their pages come from the book cache of this process."""
+        pool = decodepool.POOL
+        return pool is not None and pool.usable() and not self._is_solid()
+
+    def _offloaded(self, method, *args):
+        with metrics.PAGE_SECONDS.time(format=self.type, operation='pool'):
+            return decodepool.POOL.call(self.file_path, method, *args)
+
+    def _page_source_id(self, index):
+        """Identifies the source of a resized variant: this file as of its mtime,
+        and the page's entry name. Needs no archive access, so a reader loaded
+        from a manifest does not list the archive for it. A CRC32 and size are
+        not enough, because unrelated pages in a large library can collide."""
+        entry = self._page_names[index] if 0 <= index < len(self._page_names) else index
+        return (self.file_path, self._mtime_ns, entry)
+
+    def _resize_page(self, index, variant):
+        width, height, fmt, quality = variant
+        key = (self._page_source_id(index), variant)
+        if self.render_cache is not None:
+            data = self.render_cache.get(key)
+            if data is not None:
+                return data
+
+        if self._offload():
+            # The worker reads the page itself; cheaper than shipping it there
+            data = self._offloaded('_resize_page', index, variant)
+        else:
+            # The full page is often in memory already from normal reading
+            data = self.page_cache.peek((self.file_path, index, None)) if self.page_cache is not None else None
+            if data is None:
+                data = self._read_page(index)
+            if data is None:
+                return None
+            with metrics.PAGE_SECONDS.time(format=self.type, operation='resize'):
+                data = images.resize(data, width, height, fmt, quality)
+        if data is None:
+            return None
+        if self.render_cache is not None:
+            self.render_cache.put(key, data)
+        return data
+
+    def _read_page(self, index, variant=None):
+        try:
+            if self.type == 'pdf':
+                if 0 <= index < self._pdf_page_count:
+                    return self._render_pdf_page(index, *(variant or self._variant(None, None, None, None)))
+            
+            elif self.type in ['cbz', 'cbr']:
                 if 0 <= index < len(self._page_names):
-                    # Check if unrar is available implicitly by the error
-                    with rarfile.RarFile(self.file_path, 'r') as rf:
-                        return rf.read(self._page_names[index])
-        except rarfile.RarExecError as e:
-            print(f"CBR Error (UnRAR not found?): {e}")
+                    if variant is not None:
+                        return self._resize_page(index, variant)
+                    if self.book_cache is not None and self._is_solid():
+                        data = self._read_extracted(index)
+                        if data is not None:
+                            return data
+                    if self.type == 'cbz' and self._offload() and self.get_stored_span(index) is None:
+                        # Deflated entry: inflate in a worker
+                        return self._offloaded('_read_page', index)
+                    # Archive handles are not safe for concurrent reads
+                    with self._lock, metrics.PAGE_SECONDS.time(format=self.type, operation='extract'):
+                        return self._open_archive().read(self._page_names[index])
         except Exception as e:
-            print(f"Error reading page {index} of {self.file_path}: {type(e).__name__} - {e}")
+            # Checked by name so a failed read never imports rarfile
+            if 'rarfile' in sys.modules and isinstance(e, sys.modules['rarfile'].RarExecError):
+                log.error("CBR Error (UnRAR not found?): %s", e)
+            else:
+                log.error("Error reading page %d of %s: %s - %s", index, self.file_path, type(e).__name__, e)
+        return None
+
+    def _book_key(self):
+        return (self.file_path, self._mtime_ns)
+
+    def _read_extracted(self, index):
+        """Page bytes from the extracted copy of a solid archive, None to fall back
+        to reading the entry. The first page is cheap to read directly (it starts
+        the stream), so opening a book for its cover does not extract it."""
+        key = self._book_key()
+        if self._extract_failed or (index == 0 and key not in self.book_cache):
             return None
+        page_file = _book_page_name(index, self._page_names[index])
+        # A second try covers the book being evicted between lookup and read
+        for _ in range(2):
+            try:
+                book_dir = self.book_cache.get(key, self._extract_book)
+            except Exception as e:
+                log.error("Error extracting %s: %s - %s", self.file_path, type(e).__name__, e)
+                self._extract_failed = True
+                return None
+            if book_dir is None:
+                return None
+            try:
+                with metrics.PAGE_SECONDS.time(format=self.type, operation='extract'):
+                    with open(os.path.join(book_dir, page_file), 'rb') as f:
+                        return f.read()
+            except FileNotFoundError:
+                continue
         return None
 
+    def _extract_book(self, dest):
+        """Writes every page into dest in a single decompression pass: the tool
+        prints all entries in archive order, which are split by their sizes"""
+        with self._lock:
+            infos = self._open_archive().infolist()
+        wanted = {name: i for i, name in enumerate(self._page_names)}
+        start = time.perf_counter()
+        rarfile = _rarfile()
+        cmd = rarfile.tool_setup().open_cmdline(None, self.file_path)
+        proc = rarfile.custom_popen(cmd)
+        try:
+            for info in infos:
+                if info.is_dir():
+                    continue
+                index = wanted.get(info.filename)
+                if index is None:
+                    _skip_exact(proc.stdout, info.file_size)
+                    continue
+                data = _read_exact(proc.stdout, info.file_size)
+                if len(data) != info.file_size:
+                    raise _rarfile().BadRarFile(f"Unexpected end of data at {info.filename}")
+                if info.CRC is not None and zlib.crc32(data) != info.CRC:
+                    raise _rarfile().BadRarFile(f"CRC mismatch at {info.filename}")
+                with open(os.path.join(dest, _book_page_name(index, info.filename)), 'wb') as f:
+                    f.write(data)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        metrics.PAGE_SECONDS.observe(time.perf_counter() - start, format=self.type, operation='extract_book')
+
+    def get_page_thumbnail(self, index, size, quality=80):
+        """Returns JPEG bytes of the page at index scaled to fit within size (w, h)"""
+        try:
+            if self._offload():
+                return self._offloaded('get_page_thumbnail', index, size, quality)
+            if self.type == 'pdf':
+                if not 0 <= index < self._pdf_page_count:
+                    return None
+                # Render straight at thumbnail scale instead of a full 2x page
+                doc = self._open_document()
+                with PDFIUM_LOCK:
+                    page = doc[index]
+                    scale = min(size[0] / page.get_width(), size[1] / page.get_height())
+                    image = page.render(scale=scale).to_pil()
+            else:
+                data = self.get_page_data(index)
+                if data is None:
+                    return None
+                image = images.decode(data)
+                # Lets the JPEG decoder downscale while decoding
+                image.draft('RGB', size)
+
+            image.thumbnail(size)
+            return images.encode(image, 'jpeg', quality)
+        except Exception as e:
+            log.error("Error building thumbnail %d of %s: %s - %s", index, self.file_path, type(e).__name__, e)
+            return None
+
     def close(self):
-        if self._doc:
-            self._doc.close()
+        self._closed = True
+        with self._lock:
+            if self._archive:
+                self._archive.close()
+                self._archive = None
+            if self._doc:
+                with PDFIUM_LOCK:
+                    self._doc.close()
+                self._doc = None
@@ -1,70 +1,243 @@
+import hashlib
+import logging
 import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import covers
 import database
+import metrics
+
+log = logging.getLogger(__name__)
 
 SUPPORTED_EXTS = ['.cbz', '.cbr', '.pdf', '.zip', '.rar']
 
+# Directories listed concurrently; mostly helps on high-latency network mounts
+SCAN_WORKERS = int(os.environ.get('KUBRICK_SCAN_WORKERS', 8))
+
+# Bytes hashed from each end of a file for its content fingerprint
+FINGERPRINT_BLOCK = 64 * 1024
+# Larger ZIP central directories are left to the tail block
+FINGERPRINT_CENTRAL_DIR_MAX = 4 * 1024 * 1024
+
+def is_supported(name):
+    return os.path.splitext(name)[1].lower() in SUPPORTED_EXTS
+
+def _list_dir(path):
+    """Returns ([(file_path, size, mtime_ns)], [subdir paths]) for one directory"""
+    files, subdirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif is_supported(entry.name) and entry.is_file():
+                    # DirEntry.stat() is free on Windows and one syscall elsewhere
+                    st = entry.stat()
+                    files.append((entry.path, st.st_size, st.st_mtime_ns))
+            except OSError as e:
+                log.warning("Error scanning %s: %s", entry.path, e)
+    return files, subdirs
+
+def _walk(root):
+    """Lists every supported file under root, one directory per worker.
+    Returns (files, failed_dirs)."""
+    files, failed = [], []
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix='scan') as executor:
+        pending = {executor.submit(_list_dir, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    dir_files, subdirs = future.result()
+                except OSError as e:
+                    log.warning("Error listing %s: %s", path, e)
+                    failed.append(path)
+                    continue
+                files.extend(dir_files)
+                for subdir in subdirs:
+                    pending[executor.submit(_list_dir, subdir)] = subdir
+    return files, failed
+
+def content_fingerprint(path, size):
+    """sha1 of the size, the first and last FINGERPRINT_BLOCK bytes and, for
+    ZIPs, the central directory (every entry's name, size and CRC). Cheap
+    enough for every scanned file, and it survives moves and renames, unlike
+    the path. Returns None when the file cannot be read."""
+    digest = hashlib.sha1(str(size).encode())
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(FINGERPRINT_BLOCK)
+            digest.update(head)
+            tail = head
+            if size > FINGERPRINT_BLOCK:
+                f.seek(max(FINGERPRINT_BLOCK, size - FINGERPRINT_BLOCK))
+                tail = f.read()
+                digest.update(tail)
+            eocd = tail.rfind(b'PK\x05\x06')
+            if eocd != -1 and len(tail) - eocd >= 22:
+                cd_size, cd_offset = struct.unpack_from('<II', tail, eocd + 12)
+                if 0 < cd_size <= FINGERPRINT_CENTRAL_DIR_MAX and cd_offset + cd_size <= size:
+                    f.seek(cd_offset)
+                    digest.update(f.read(cd_size))
+    except OSError as e:
+        log.warning("Could not fingerprint %s: %s", path, e)
+        return None
+    return digest.hexdigest()
+
+def _fingerprints(files):
+    """{file_path: content fingerprint} for (file_path, size) pairs, read concurrently"""
+    if len(files) < 2:
+        return {path: content_fingerprint(path, size) for path, size in files}
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix='fingerprint') as executor:
+        hashes = executor.map(lambda f: content_fingerprint(*f), files)
+        return dict(zip((path for path, _ in files), hashes))
+
+def _find_moves(added, hashes, removed_ids):
+    """Matches new paths to existing comics with the same content whose file is
+    gone (removed in this sync or missing on disk): a folder moved or renamed
+    while the app was closed, or a move the watcher saw as delete + create.
+    Returns [(comic_id, new_path, title)]."""
+    candidates = database.get_comics_by_content_hash({hashes[p] for p in added if hashes.get(p)})
+    removed, claimed, moves = set(removed_ids), set(), []
+    for path in added:
+        for comic_id, old_path, title in candidates.get(hashes.get(path), ()):
+            if comic_id in claimed or (comic_id not in removed and os.path.exists(old_path)):
+                continue
+            claimed.add(comic_id)
+            # Titles still derived from the old file name follow the new one
+            if title == os.path.splitext(os.path.basename(old_path))[0]:
+                title = os.path.splitext(os.path.basename(path))[0]
+            moves.append((comic_id, path, title))
+            break
+    return moves
+
+def _under(path, dirs):
+    return any(path.startswith(d.rstrip(os.sep) + os.sep) for d in dirs)
+
+def _sync(found, known, removed_ids):
+    """Upserts new/changed files in found against their known fingerprints and
+    removes removed_ids, in one transaction. New files with the content of a
+    comic whose file is gone take over that comic instead. Returns a dict of counts."""
+    result = {'added': 0, 'updated': 0, 'moved': 0, 'removed': 0, 'skipped': 0,
+              'removed_ids': [], 'moved_ids': [], 'updated_ids': [], 'updated_paths': []}
+    rows, added, to_hash = [], [], []
+    for file_path, size, mtime_ns in found:
+        if file_path not in known:
+            added.append(file_path)
+            rows.append((file_path, size, mtime_ns))
+            to_hash.append((file_path, size))
+            continue
+
+        comic_id, known_size, known_mtime, known_hash = known[file_path]
+        if known_size == size and known_mtime == mtime_ns:
+            result['skipped'] += 1
+            if known_hash is None:
+                # Row predates content fingerprints
+                rows.append((file_path, size, mtime_ns))
+                to_hash.append((file_path, size))
+            continue
+        if known_size == size and known_mtime is None:
+            # Row predates fingerprints, just record the mtime
+            result['skipped'] += 1
+        else:
+            # Rewritten in place: callers drop open readers and cached pages
+            result['updated'] += 1
+            result['updated_ids'].append(comic_id)
+            result['updated_paths'].append(file_path)
+        rows.append((file_path, size, mtime_ns))
+        to_hash.append((file_path, size))
+
+    hashes = _fingerprints(to_hash)
+    moves = _find_moves(added, hashes, removed_ids) if added else []
+    moved_ids = {comic_id for comic_id, _, _ in moves}
+    removed_ids = [comic_id for comic_id in removed_ids if comic_id not in moved_ids]
+    result['moved'] = len(moves)
+    result['added'] = len(added) - len(moves)
+
+    upserts = []
+    for file_path, size, mtime_ns in rows:
+        name = os.path.basename(file_path)
+        ext = os.path.splitext(name)[1].lower()
+        upserts.append((file_path, os.path.splitext(name)[0], ext.replace('.', ''), size, mtime_ns,
+                        hashes.get(file_path)))
+
+    for comic_id in removed_ids:
+        covers.remove_cover(comic_id)
+
+    database.apply_scan(upserts, removed_ids, moves)
+    result['removed'] = len(removed_ids)
+    for key in ('added', 'updated', 'moved', 'removed', 'skipped'):
+        if result[key]:
+            metrics.SCAN_FILES.inc(result[key], result=key)
+    result['removed_ids'] = list(removed_ids)
+    result['moved_ids'] = sorted(moved_ids)
+    return result
+
 def scan_directory(path):
+    """Incrementally syncs the comics table with a file or directory tree.
+
+    Files whose size and mtime match the stored fingerprint are skipped, new
+    and changed ones are upserted, and comics whose files disappeared from a
+    scanned directory are removed, unless their content turned up under a new
+    path. Returns a dict of counts.
+    """
     # Normalize path
     path = os.path.abspath(path)
-    print(f"--- SCAN START ---")
-    print(f"Target: {repr(path)}")
-    print(f"Exists: {os.path.exists(path)}")
-    print(f"Is File: {os.path.isfile(path)}")
-    print(f"Is Dir: {os.path.isdir(path)}")
-    
-    added_count = 0
-    
-    # CASE 1: Single File
+    start = time.perf_counter()
+
     if os.path.isfile(path):
-        ext = os.path.splitext(path)[1].lower()
-        print(f"Checking single file extension: {ext}")
-        if ext in SUPPORTED_EXTS:
+        if not is_supported(path):
+            log.info("Scan ignored %s: extension not supported", path)
+            return _sync([], {}, [])
+        st = os.stat(path)
+        found, failed = [(path, st.st_size, st.st_mtime_ns)], []
+    elif os.path.isdir(path):
+        found, failed = _walk(path)
+    else:
+        log.error("Scan error: %s is neither a file nor a directory", path)
+        return _sync([], {}, [])
+
+    known = database.get_scan_fingerprints(path)
+    seen = {f[0] for f in found}
+    removed_ids = [
+        comic_id for file_path, (comic_id, *_) in known.items()
+        if file_path not in seen and not _under(file_path, failed)
+    ]
+    result = _sync(found, known, removed_ids)
+
+    elapsed = time.perf_counter() - start
+    metrics.SCAN_SECONDS.observe(elapsed)
+    metrics.SCAN_FILES_PER_SECOND.set(round(len(found) / elapsed, 1) if elapsed else 0)
+    log.info("Scan of %s: %d added, %d updated, %d moved, %d removed, %d unchanged in %.2fs",
+             path, result['added'], result['updated'], result['moved'], result['removed'], result['skipped'], elapsed,
+             extra={'scan': {k: v for k, v in result.items() if isinstance(v, int)}, 'seconds': round(elapsed, 3)})
+    return result
+
+def apply_changes(changed_paths, deleted_paths):
+    """Syncs only the given paths, e.g. from filesystem events.
+
+    changed_paths: created/modified files (directories are walked)
+    deleted_paths: removed files or directories
+    """
+    found, known, removed_ids = {}, {}, []
+    for path in deleted_paths:
+        for comic_id, *_ in database.get_scan_fingerprints(path).values():
+            removed_ids.append(comic_id)
+
+    for path in changed_paths:
+        if os.path.isdir(path):
+            files, _ = _walk(path)
+            found.update((f[0], f) for f in files)
+        elif is_supported(path):
             try:
-                size = os.path.getsize(path)
-                title = os.path.splitext(os.path.basename(path))[0]
-                print(f"Attempting DB Upsert: {title} ({ext})")
-                
-                # Check DB Connection
-                try:
-                    database.upsert_comic(path, title, ext.replace('.', ''), size)
-                    print(f"SUCCESS: Added {title}")
-                    return 1
-                except Exception as db_err:
-                    print(f"DB ERROR: {db_err}")
-                    return 0
-            except Exception as e:
-                print(f"FILE ACCESS ERROR: {e}")
-                return 0
-        else:
-            print(f"IGNORED: Extension {ext} not supported")
-            return 0
-
-    # CASE 2: Directory
-    if not os.path.isdir(path):
-        print(f"ERROR: Path is neither a file nor a directory.")
-        return 0
-        
-    for root, dirs, files in os.walk(path):
-        print(f"Scanning dir: {root} - Found {len(files)} files")
-        for file in files:
-            ext = os.path.splitext(file)[1].lower()
-            if ext in SUPPORTED_EXTS:
-                full_path = os.path.join(root, file)
-                try:
-                    size = os.path.getsize(full_path)
-                    print(f"Found candidate: {file}")
-                    title = os.path.splitext(file)[0]
-                    
-                    database.upsert_comic(full_path, title, ext.replace('.', ''), size)
-                    print(f"SUCCESS: Upserted {file}")
-                    added_count += 1
-                except Exception as e:
-                    print(f"Error scanning {file}: {e}")
-                    continue
-            else:
-                 # Optional: Log skipped files if needed (can be noisy)
-                 # print(f"Skipping {file} (ext: {ext})")
-                 pass
-                 
-    print(f"--- SCAN END: Added {added_count} ---")
-    return added_count
+                st = os.stat(path)
+            except OSError:
+                # Gone again before we got to it
+                continue
+            found[path] = (path, st.st_size, st.st_mtime_ns)
+        known.update(database.get_scan_fingerprints(path))
+
+    return _sync(list(found.values()), known, removed_ids)
@@ -0,0 +1,282 @@
+"""Resumable chunked uploads.
+
+A client opens an upload with its file name and size, appends chunks at the
+offset the server reports, and commits once every byte is in. Chunks are
+streamed to a .part file under the cache with a running SHA-256, so nothing
+is buffered in memory and an interrupted upload continues where the file on
+disk ends, across app restarts too. On commit the file is checked against
+library files of the same size and either dropped as a duplicate or moved
+into UPLOAD_DIR.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+import database
+import scanner
+from cache import CACHE_DIR
+
+log = logging.getLogger(__name__)
+
+# Committed uploads land here
+UPLOAD_DIR = os.path.abspath(os.environ.get('KUBRICK_UPLOAD_DIR') or os.path.join(os.getcwd(), 'uploads'))
+# Partial files and their state
+STAGING_DIR = os.path.join(CACHE_DIR, 'uploads')
+# Unfinished uploads untouched for this long are deleted
+UPLOAD_EXPIRE_SECONDS = int(os.environ.get('KUBRICK_UPLOAD_EXPIRE_HOURS', 24)) * 60 * 60
+# Largest file accepted
+UPLOAD_MAX_BYTES = int(os.environ.get('KUBRICK_UPLOAD_MAX_MB', 16 * 1024)) * 1024 * 1024
+# Read size when streaming request bodies and hashing files
+COPY_BUFFER = 1024 * 1024
+
+class UploadError(Exception):
+    """A request the upload API rejects; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+def _hash_file(path, limit=None):
+    """SHA-256 object over the first limit bytes (all by default) of path"""
+    digest = hashlib.sha256()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(COPY_BUFFER if remaining is None else min(COPY_BUFFER, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest
+
+class Upload:
+    def __init__(self, upload_id, filename, size, sha256=None, offset=0, digest=None):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256  # expected, if the client sent one
+        self.offset = offset
+        self.digest = digest or hashlib.sha256()
+        # Held while a chunk is written or the upload commits
+        self.lock = threading.Lock()
+
+    @property
+    def part_path(self):
+        return os.path.join(STAGING_DIR, f'{self.id}.part')
+
+    @property
+    def state_path(self):
+        return os.path.join(STAGING_DIR, f'{self.id}.json')
+
+    def save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'filename': self.filename, 'size': self.size, 'sha256': self.sha256}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def remove_files(self):
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def to_dict(self):
+        return {'upload_id': self.id, 'filename': self.filename, 'size': self.size, 'offset': self.offset}
+
+class UploadStore:
+    """Open uploads by id. State lives on disk; the running hash of an upload
+    found there after a restart is rebuilt from its .part file."""
+
+    def __init__(self):
+        self._uploads = {}
+        self._lock = threading.Lock()
+        # (file_path, size, mtime_ns) -> sha256 hex of library files hashed for dedup
+        self._library_hashes = {}
+
+    def create(self, filename, size, sha256=None):
+        name = secure_filename(filename or '')
+        if not name or not scanner.is_supported(name):
+            raise UploadError('Unsupported file name')
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError('Invalid size')
+        if size > UPLOAD_MAX_BYTES:
+            raise UploadError('File too large', status=413)
+        if sha256 is not None:
+            sha256 = str(sha256).lower()
+            duplicate = self.find_duplicate(size, sha256)
+            if duplicate is not None:
+                return None, duplicate
+
+        self.expire()
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        upload = Upload(uuid.uuid4().hex, name, size, sha256)
+        open(upload.part_path, 'wb').close()
+        upload.save_state()
+        with self._lock:
+            self._uploads[upload.id] = upload
+        log.info("Upload %s opened for %s (%d bytes)", upload.id, name, size)
+        return upload, None
+
+    def get(self, upload_id):
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is not None:
+            return upload
+        upload = self._load(upload_id)
+        if upload is None:
+            raise UploadError('Unknown upload', status=404)
+        with self._lock:
+            return self._uploads.setdefault(upload_id, upload)
+
+    def _load(self, upload_id):
+        if not upload_id.isalnum():
+            return None
+        state_path = os.path.join(STAGING_DIR, f'{upload_id}.json')
+        part_path = os.path.join(STAGING_DIR, f'{upload_id}.part')
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            offset = min(os.path.getsize(part_path), state['size'])
+            digest = _hash_file(part_path, offset)
+        except (OSError, ValueError, KeyError):
+            return None
+        log.info("Upload %s resumed at %d of %d bytes", upload_id, offset, state['size'])
+        return Upload(upload_id, state['filename'], state['size'], state.get('sha256'), offset, digest)
+
+    def append(self, upload_id, offset, stream):
+        """Writes stream at offset, which must be where the upload currently ends.
+        A dropped connection keeps whatever arrived; the client resumes from the
+        offset the status call reports."""
+        upload = self.get(upload_id)
+        if not upload.lock.acquire(blocking=False):
+            raise UploadError('Upload busy', status=409, offset=upload.offset)
+        try:
+            if offset != upload.offset:
+                raise UploadError('Offset mismatch', status=409, offset=upload.offset)
+            with open(upload.part_path, 'r+b') as f:
+                f.seek(upload.offset)
+                # Anything past the offset is a chunk that never completed
+                f.truncate()
+                while True:
+                    chunk = stream.read(COPY_BUFFER)
+                    if not chunk:
+                        break
+                    if upload.offset + len(chunk) > upload.size:
+                        raise UploadError('Data past the declared size', status=413, offset=upload.offset)
+                    f.write(chunk)
+                    upload.digest.update(chunk)
+                    upload.offset += len(chunk)
+            return upload.to_dict()
+        finally:
+            upload.lock.release()
+
+    def commit(self, upload_id):
+        """Finishes an upload. Returns (path, None) for a new library file, or
+        (None, comic) when the library already holds the same bytes."""
+        upload = self.get(upload_id)
+        with upload.lock:
+            if upload.offset != upload.size:
+                raise UploadError('Upload incomplete', status=409, offset=upload.offset)
+            sha256 = upload.digest.hexdigest()
+            if upload.sha256 and upload.sha256 != sha256:
+                self._drop(upload)
+                raise UploadError('Checksum mismatch', status=422)
+
+            duplicate = self.find_duplicate(upload.size, sha256)
+            if duplicate is not None:
+                self._drop(upload)
+                log.info("Upload %s is a duplicate of comic %s", upload.id, duplicate['id'])
+                return None, duplicate
+
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            path = _unique_path(os.path.join(UPLOAD_DIR, upload.filename))
+            # The staging folder lives in the cache, which may be on another volume
+            shutil.move(upload.part_path, path)
+            self._drop(upload)
+            st = os.stat(path)
+            self._remember(path, st, sha256)
+            log.info("Upload %s committed to %s", upload.id, path)
+            return path, None
+
+    def store(self, filename, stream):
+        """One-shot upload of a stream of unknown length (multipart form posts);
+        same result as commit()"""
+        upload, _ = self.create(filename, UPLOAD_MAX_BYTES)
+        try:
+            self.append(upload.id, 0, stream)
+            upload.size = upload.offset
+            return self.commit(upload.id)
+        except BaseException:
+            # Nobody knows this upload's id, so nobody can resume it
+            self._drop(upload)
+            raise
+
+    def abort(self, upload_id):
+        upload = self.get(upload_id)
+        with upload.lock:
+            self._drop(upload)
+
+    def _drop(self, upload):
+        upload.remove_files()
+        with self._lock:
+            self._uploads.pop(upload.id, None)
+
+    def expire(self):
+        """Deletes unfinished uploads nobody has written to for UPLOAD_EXPIRE_SECONDS"""
+        try:
+            names = os.listdir(STAGING_DIR)
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - UPLOAD_EXPIRE_SECONDS
+        for name in names:
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.json':
+                continue
+            upload = Upload(upload_id, None, None)
+            try:
+                # Chunks touch the .part file, not the state
+                if os.path.getmtime(upload.part_path) >= cutoff:
+                    continue
+            except OSError:
+                pass
+            log.info("Upload %s expired", upload_id)
+            self._drop(upload)
+
+    def find_duplicate(self, size, sha256):
+        """A library comic whose file has exactly these bytes, or None.
+        Only files of the same size are hashed, and each only once per version."""
+        for comic in database.get_comics_by_size(size):
+            try:
+                st = os.stat(comic['file_path'])
+                key = (comic['file_path'], st.st_size, st.st_mtime_ns)
+                digest = self._library_hashes.get(key)
+                if digest is None:
+                    digest = _hash_file(comic['file_path']).hexdigest()
+                    self._library_hashes[key] = digest
+            except OSError:
+                continue
+            if digest == sha256:
+                return comic
+        return None
+
+    def _remember(self, path, st, sha256):
+        self._library_hashes[(path, st.st_size, st.st_mtime_ns)] = sha256
+
+def _unique_path(path):
+    """path, or 'name (2).ext' and so on if it is taken"""
+    base, ext = os.path.splitext(path)
+    n = 1
+    while os.path.exists(path):
+        n += 1
+        path = f'{base} ({n}){ext}'
+    return path
@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+import database
+import scanner
+
+log = logging.getLogger(__name__)
+
+# Events are applied once the tree has been quiet for DEBOUNCE_SECONDS, or at
+# the latest MAX_DELAY_SECONDS after the first one (long copies keep firing)
+DEBOUNCE_SECONDS = float(os.environ.get('KUBRICK_WATCH_DEBOUNCE', 2.0))
+MAX_DELAY_SECONDS = float(os.environ.get('KUBRICK_WATCH_MAX_DELAY', 30.0))
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        self.watcher.record(event.src_path, 'changed', event.is_directory)
+
+    def on_modified(self, event):
+        # Directory mtime changes carry no information we need
+        if not event.is_directory:
+            self.watcher.record(event.src_path, 'changed', False)
+
+    def on_deleted(self, event):
+        self.watcher.record(event.src_path, 'deleted', event.is_directory)
+
+    def on_moved(self, event):
+        self.watcher.record_move(event.src_path, event.dest_path, event.is_directory)
+
+class LibraryWatcher:
+    """Watches library roots and applies coalesced create/modify/move/delete
+    deltas to the comics table.
+
+    on_change(comic_ids, paths) is called after each batch with the ids and
+    paths whose files changed, moved or disappeared, so callers can drop
+    cached readers and pages.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self._observer = None
+        self._watches = {}
+        self._lock = threading.Lock()
+        # Path -> 'changed' | 'deleted' (last event wins), plus ordered moves
+        self._pending = {}
+        self._moves = []
+        self._timer = None
+        self._first_event_at = None
+
+    def start(self, roots=()):
+        with self._lock:
+            if self._observer is None:
+                self._observer = Observer()
+                self._observer.daemon = True
+                self._observer.start()
+        for root in roots:
+            self.add_root(root)
+
+    def add_root(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._observer is None or path in self._watches or not os.path.isdir(path):
+                return
+            # Already covered by a recursive watch on a parent
+            if any(path.startswith(root.rstrip(os.sep) + os.sep) for root in self._watches):
+                return
+            try:
+                self._watches[path] = self._observer.schedule(_EventHandler(self), path, recursive=True)
+                log.info("Watching %s", path)
+            except OSError as e:
+                log.warning("Cannot watch %s: %s", path, e)
+
+    def stop(self):
+        with self._lock:
+            observer, self._observer = self._observer, None
+            self._watches.clear()
+            if self._timer:
+                self._timer.cancel()
+        if observer:
+            observer.stop()
+        self.flush()
+
+    def _relevant(self, path, is_directory):
+        return is_directory or scanner.is_supported(path)
+
+    def record(self, path, kind, is_directory):
+        if not self._relevant(path, is_directory):
+            return
+        with self._lock:
+            self._pending[path] = kind
+            self._schedule()
+
+    def record_move(self, src, dest, is_directory):
+        src_ok = self._relevant(src, is_directory)
+        dest_ok = self._relevant(dest, is_directory)
+        with self._lock:
+            if src_ok and dest_ok:
+                self._moves.append((src, dest))
+                self._pending.pop(src, None)
+            elif src_ok:
+                # Renamed to something we don't read
+                self._pending[src] = 'deleted'
+            elif dest_ok:
+                # E.g. a download finishing as file.cbz.part -> file.cbz
+                self._pending[dest] = 'changed'
+            else:
+                return
+            self._schedule()
+
+    def _schedule(self):
+        now = time.monotonic()
+        if self._first_event_at is None:
+            self._first_event_at = now
+        if self._timer:
+            self._timer.cancel()
+        delay = min(DEBOUNCE_SECONDS, max(0.0, self._first_event_at + MAX_DELAY_SECONDS - now))
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Applies every pending event now"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            moves, self._moves = self._moves, []
+            self._timer = None
+            self._first_event_at = None
+        if not pending and not moves:
+            return
+
+        try:
+            touched = []
+            # Moves keep the comic rows (and their progress) instead of delete + add
+            for src, dest in moves:
+                touched.extend(database.relocate_comics(src, dest))
+                pending.setdefault(dest, 'changed')
+
+            changed = [p for p, kind in pending.items() if kind == 'changed']
+            deleted = [p for p, kind in pending.items() if kind == 'deleted']
+            result = scanner.apply_changes(changed, deleted)
+            touched.extend(result['removed_ids'] + result['moved_ids'])
+            touched.extend(database.get_comic_ids_by_paths(changed))
+
+            log.info("Watch: %d moved, %d added, %d updated, %d removed",
+                     len(moves) + result['moved'], result['added'], result['updated'], result['removed'])
+            if self.on_change:
+                paths = list(pending) + [src for src, _ in moves]
+                self.on_change(sorted(set(touched)), paths)
+        except Exception as e:
+            log.exception("Error applying file changes: %s - %s", type(e).__name__, e)
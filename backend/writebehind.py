@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+from datetime import datetime
+
+import database
+
+log = logging.getLogger(__name__)
+
+# Longest a page turn waits in memory before it is committed
+FLUSH_INTERVAL = float(os.environ.get('KUBRICK_PROGRESS_FLUSH_SECONDS', 2))
+
+class ProgressBuffer:
+    """Write-behind buffer for reading progress.
+
+    Page turns only record the latest page per comic in memory. A background
+    thread commits whatever is pending in one transaction every interval
+    seconds, and stop() (run at exit) commits the rest.
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = {}  # comic_id -> (page, read_at)
+        self._lock = threading.Lock()
+        # Serializes flushes so an older batch never lands after a newer one
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.updates = 0
+        self.commits = 0
+        self.rows_written = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='progress-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("Error saving reading progress: %s - %s", type(e).__name__, e)
+
+    def record(self, comic_id, page):
+        self.start()
+        with self._lock:
+            self._pending[int(comic_id)] = (page, datetime.now())
+            self.updates += 1
+
+    def discard(self, comic_id):
+        with self._lock:
+            self._pending.pop(int(comic_id), None)
+
+    def overlay(self, comic):
+        """Applies a pending update to a comics row (dict) so reads see their own writes"""
+        with self._lock:
+            pending = self._pending.get(comic['id'])
+        if pending is not None:
+            page, read_at = pending
+            # Same text form sqlite3 stores datetimes in
+            comic['current_page'], comic['last_read_at'] = page, str(read_at)
+            comic['status'] = 'reading'
+        return comic
+
+    def flush(self):
+        """Commits everything pending. Returns the number of comics written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                database.save_progress(pending)
+            except Exception:
+                # Put the batch back unless newer updates arrived meanwhile
+                with self._lock:
+                    for comic_id, update in pending.items():
+                        self._pending.setdefault(comic_id, update)
+                raise
+            with self._lock:
+                self.commits += 1
+                self.rows_written += len(pending)
+            return len(pending)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'updates': self.updates,
+                'commits': self.commits,
+                'rows_written': self.rows_written,
+                # Each update used to be its own commit
+                'commits_saved': self.updates - len(self._pending) - self.commits,
+                'interval_seconds': self.interval,
+            }
@@ -2,6 +2,51 @@ import { useEffect, useState, useMemo, useRef } from 'react'
 import { PlusCircle, RefreshCw, BookOpen, Search, SortAsc, Clock, Grid, Settings as SettingsIcon, Folder, FolderPlus, MoreVertical, X, Check } from 'lucide-react'
 import { useSettings } from '../contexts/SettingsContext'
 
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+const UPLOAD_RETRIES = 5
+
+// Chunked, resumable upload: after a failed chunk the server's offset says where to continue
+const uploadFile = async (file) => {
+    const base = 'http://localhost:5000/api/uploads'
+    const res = await fetch(base, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    })
+    if (!res.ok) throw new Error(await res.text())
+    const { upload_id: id } = await res.json()
+
+    let offset = 0
+    let failures = 0
+    while (offset < file.size) {
+        try {
+            const chunk = await fetch(`${base}/${id}?offset=${offset}`, {
+                method: 'PUT',
+                body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE)
+            })
+            if (chunk.ok) {
+                offset = (await chunk.json()).offset
+                failures = 0
+                continue
+            }
+            if (chunk.status !== 409) throw new Error(await chunk.text())
+        } catch (err) {
+            if (++failures > UPLOAD_RETRIES) {
+                await fetch(`${base}/${id}`, { method: 'DELETE' }).catch(() => {})
+                throw err
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures))
+        }
+        const status = await fetch(`${base}/${id}`)
+        if (!status.ok) throw new Error(await status.text())
+        offset = (await status.json()).offset
+    }
+
+    const commit = await fetch(`${base}/${id}/commit`, { method: 'POST' })
+    if (!commit.ok) throw new Error(await commit.text())
+    return commit.json()
+}
+
 const Library = ({ onOpen, onOpenSettings }) => {
     const { t } = useSettings()
     const [books, setBooks] = useState([])
@@ -247,15 +292,8 @@ const Library = ({ onOpen, onOpenSettings }) => {
             } else {
                 // Fallback: Web Upload
                 try {
-                    const formData = new FormData()
-                    formData.append('file', file)
-
-                    const res = await fetch('http://localhost:5000/api/upload', {
-                        method: 'POST',
-                        body: formData
-                    })
-                    if (res.ok) addedCount++
-                    else console.error("Upload failed", await res.text())
+                    const result = await uploadFile(file)
+                    if (result.added) addedCount++
                 } catch (err) {
                     console.error("Upload error:", err)
                 }
@@ -2,6 +2,126 @@ import { useEffect, useState, useRef, useCallback, memo } from 'react'
 import { ArrowLeft, ZoomIn, ZoomOut, Maximize, ChevronLeft, ChevronRight, FileText, BookOpen, Columns, Move, Search, PanelLeft, Sliders, Eye, EyeOff, Star, MessageSquare, Save, X } from 'lucide-react'
 import { useSettings } from '../contexts/SettingsContext'
 
+// Sidebar thumbnails are requested pre-scaled (2x the sidebar width for HiDPI screens)
+const THUMB_WIDTH = 320
+
+// Pages per /pages request in the scrolling views
+const PAGE_BATCH_SIZE = 10
+const THUMB_BATCH_SIZE = 20
+
+// Reads a multipart/mixed /pages response as it streams in, calling
+// onPage(index, blob) as soon as each part is complete
+const readPageBatch = async (response, onPage) => {
+    const boundary = /boundary=([^;\s]+)/.exec(response.headers.get('Content-Type') || '')?.[1]
+    if (!boundary) throw new Error('Not a page batch')
+    const closing = `--${boundary}--`
+    const decoder = new TextDecoder()
+    const stream = response.body.getReader()
+    let buffer = new Uint8Array(1 << 20)
+    let start = 0
+    let end = 0
+    let part = null // headers of the part whose body is being read
+
+    const headerEnd = () => {
+        for (let i = start; i + 3 < end; i++) {
+            if (buffer[i] === 13 && buffer[i + 1] === 10 && buffer[i + 2] === 13 && buffer[i + 3] === 10) return i
+        }
+        return -1
+    }
+
+    for (;;) {
+        if (!part) {
+            if (decoder.decode(buffer.subarray(start, start + closing.length)) === closing) return
+            const at = headerEnd()
+            if (at >= 0) {
+                part = {}
+                decoder.decode(buffer.subarray(start, at)).split('\r\n').slice(1).forEach(line => {
+                    const colon = line.indexOf(':')
+                    part[line.slice(0, colon).trim().toLowerCase()] = line.slice(colon + 1).trim()
+                })
+                start = at + 4
+                continue
+            }
+        } else {
+            const length = parseInt(part['content-length'], 10)
+            // Body plus the CRLF that ends it
+            if (end - start >= length + 2) {
+                if (!part['x-page-error']) {
+                    onPage(parseInt(part['x-page-index'], 10),
+                        new Blob([buffer.slice(start, start + length)], { type: part['content-type'] }))
+                }
+                start += length + 2
+                part = null
+                continue
+            }
+        }
+
+        const { done, value } = await stream.read()
+        if (done) return
+        if (end + value.length > buffer.length) {
+            const grown = new Uint8Array(Math.max(buffer.length * 2, end - start + value.length))
+            grown.set(buffer.subarray(start, end))
+            end -= start
+            start = 0
+            buffer = grown
+        }
+        buffer.set(value, end)
+        end += value.length
+    }
+}
+
+// Object URLs of pages loaded batchSize at a time through /pages.
+// request(i) loads the batch holding page i once; isPending(i) is true while
+// it loads, so callers can hold off a separate request for the same page.
+// A failed batch falls back to the per-page endpoint.
+const usePageBatches = (comicId, query, batchSize) => {
+    const [urls, setUrls] = useState({})
+    const batches = useRef(new Map()) // batch number -> 'loading' | 'done' | 'failed'
+    const created = useRef([])
+    // Bumped when the comic or query changes, so late responses are dropped
+    const generation = useRef(0)
+
+    useEffect(() => {
+        generation.current += 1
+        batches.current = new Map()
+        setUrls({})
+        return () => {
+            generation.current += 1
+            created.current.forEach(url => URL.revokeObjectURL(url))
+            created.current = []
+        }
+    }, [comicId, query])
+
+    const request = useCallback((index) => {
+        const map = batches.current
+        const batch = Math.floor(index / batchSize)
+        if (!comicId || map.has(batch)) return
+        map.set(batch, 'loading')
+        const current = generation.current
+        const params = `from=${batch * batchSize}&count=${batchSize}${query ? `&${query}` : ''}`
+        fetch(`http://localhost:5000/api/comic/${comicId}/pages?${params}`)
+            .then(res => {
+                if (!res.ok) throw new Error(`Status ${res.status}`)
+                return readPageBatch(res, (i, blob) => {
+                    if (generation.current !== current) return
+                    const url = URL.createObjectURL(blob)
+                    created.current.push(url)
+                    setUrls(u => ({ ...u, [i]: url }))
+                })
+            })
+            .then(() => map.set(batch, 'done'))
+            .catch(err => {
+                console.error('Page batch failed:', err)
+                map.set(batch, 'failed')
+                if (generation.current === current) setUrls(u => ({ ...u }))
+            })
+    }, [comicId, query, batchSize])
+
+    const isPending = useCallback((index) => batches.current.get(Math.floor(index / batchSize)) === 'loading', [batchSize])
+
+    return [urls, request, isPending]
+}
+
 // Standard Side Components (No memo for stability)
 const SidebarList = ({ meta, comicId, currentPage, onPageSelect, pageActions, filterStyle }) => {
     // Refs disabled temporarily
@@ -18,6 +138,14 @@ const SidebarList = ({ meta, comicId, currentPage, onPageSelect, pageActions, fi
     }, [currentPage])
     */
 
+    const [thumbUrls, requestThumbs, thumbPending] = usePageBatches(comicId, `w=${THUMB_WIDTH}&fmt=webp`, THUMB_BATCH_SIZE)
+    useEffect(() => {
+        if (!meta) return
+        // The thumbnails around the current page are the ones on screen
+        requestThumbs(currentPage)
+        if (currentPage + THUMB_BATCH_SIZE / 2 < meta.page_count) requestThumbs(currentPage + THUMB_BATCH_SIZE / 2)
+    }, [meta, currentPage, requestThumbs])
+
     if (!meta) return null
 
     return (
@@ -30,7 +158,7 @@ const SidebarList = ({ meta, comicId, currentPage, onPageSelect, pageActions, fi
                     className={`cursor-pointer rounded-lg overflow-hidden border-2 transition relative group ${currentPage === i ? 'border-primary ring-2 ring-primary/20' : 'border-transparent hover:border-gray-300 dark:hover:border-gray-600'}`}
                 >
                     <img
-                        src={`http://localhost:5000/api/comic/${comicId}/page/${i}`}
+                        src={thumbUrls[i] || (thumbPending(i) ? undefined : `http://localhost:5000/api/comic/${comicId}/page/${i}?w=${THUMB_WIDTH}&fmt=webp`)}
                         className="w-full h-auto object-cover"
                         style={filterStyle}
                         loading="lazy"
@@ -78,6 +206,8 @@ const Reader = ({ comicId, onBack }) => {
     const [currentPage, setCurrentPage] = useState(0)
     const [viewMode, setViewMode] = useState(defaultViewMode || 'single')
     const scrollContainerRef = useRef(null)
+    // Continuous scroll loads pages in batches rather than one request per page
+    const [pageUrls, requestPages, pagePending] = usePageBatches(viewMode === 'vertical' ? comicId : null, '', PAGE_BATCH_SIZE)
 
     // Page Actions (Favorites & Notes)
     const [pageActions, setPageActions] = useState({})
@@ -291,6 +421,13 @@ const Reader = ({ comicId, onBack }) => {
         // eslint-disable-next-line react-hooks/exhaustive-deps
     }, [viewMode, meta]) // Intentionally omit currentPage to run only on viewMode switch
 
+    useEffect(() => {
+        if (viewMode !== 'vertical' || !meta) return
+        // Same window of pages the vertical view renders
+        requestPages(Math.max(0, currentPage - 4))
+        requestPages(Math.min(meta.page_count - 1, currentPage + 4))
+    }, [viewMode, meta, currentPage, requestPages])
+
     useEffect(() => {
         if (viewMode !== 'vertical' || !meta) return
         const observer = new IntersectionObserver((entries) => {
@@ -658,7 +795,7 @@ const Reader = ({ comicId, onBack }) => {
                                         <div className="relative" style={{ width: `${zoom}%`, maxWidth: 'none' }}>
                                             <img
                                                 className={`comic-page-vertical shadow-2xl select-none mx-auto block ${isMagnifier ? 'cursor-none' : ''}`}
-                                                src={`http://localhost:5000/api/comic/${comicId}/page/${i}`}
+                                                src={pageUrls[i] || (pagePending(i) ? undefined : `http://localhost:5000/api/comic/${comicId}/page/${i}`)}
                                                 style={{ ...filterStyle, width: '100%', height: 'auto' }}
                                                 loading="lazy"
                                                 onMouseMove={handleLoupeMove}